@@ -5,239 +5,1901 @@ import math
 import sys
 import random
 import sqlite3
+import gc
+import json
+import subprocess
+import marshal
+import operator
+import re
+import struct
+import zlib
+import threading
+import queue
+from time import perf_counter
 import numpy as np
-from collections import Counter
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
 
 
 class Camera:
     """
     Оцентровывает данный объект
+    Объекты хранят мировые координаты, которые камера не меняет,
+     камера только сдвигает картинку при отрисовке на (-offset_x, -offset_y)
     Attributes:
         x: float
-            Позиция игрока по оси абсцисс относительно положения, занимаемого в начале прохождения,
-             не зависит от клетки, в которой находится target
+            Позиция игрока по оси абсцисс относительно центра клетки, в которой он находится
         y: float
-            Позиция игрока по оси ординат относительно положения, занимаемого в начале прохождения,
-             не зависит от клетки, в которой находится target
+            Позиция игрока по оси ординат относительно центра клетки, в которой он находится
+        offset_x: float
+            Мировая координата левого верхнего угла экрана по оси абсцисс
+        offset_y: float
+            Мировая координата левого верхнего угла экрана по оси ординат
+        previous_offset: tuple
+            (offset_x, offset_y) на начало последнего шага симуляции
+        alpha: float
+            Доля шага симуляции, прошедшая после последнего шага (от 0 до 1), отрисовка идет
+             в промежуточном положении между previous_offset и (offset_x, offset_y)
     Methods:
         update(target)
             target - объект в чью систему отсчета войдет камера (объект, который будет по центру экрана)
-            Перемещает все объекты так, чтобы target оказался по центру экрана
+            Сдвигает камеру так, чтобы target оказался по центру экрана
+        save_position()
+            Запоминает сдвиг камеры в начале шага симуляции
+        draw_offset()
+            Возвращает сдвиг камеры для отрисовки (с учетом alpha), в целых числах
+        to_world(x, y)
+            Переводит экранные координаты в мировые
+        to_screen(x, y)
+            Переводит мировые координаты в экранные (с учетом alpha)
+        room_position(x, y, delta_x, delta_y)
+            Возвращает мировые координаты точки (x, y) паттерна клетки, сдвинутой на (delta_x, delta_y)
+             относительно клетки игрока
+        view()
+            Возвращает видимую часть мира в виде pygame.Rect
     """
 
     def __init__(self):
         self.x, self.y = 0, 0
+        self.offset_x, self.offset_y = 0, 0
+        self.previous_offset = (0, 0)
+        self.alpha = 1
 
     def update(self, target):
-        delta_x = (target.x + target.width // 2 - CAMERA_WIDTH // 2)
-        delta_y = (target.y + target.height // 2 - CAMERA_HEIGHT // 2)
+        delta_x = (target.x - self.offset_x + target.width // 2 - CAMERA_WIDTH // 2)
+        delta_y = (target.y - self.offset_y + target.height // 2 - CAMERA_HEIGHT // 2)
 
         self.x += delta_x
         self.y += delta_y
+        self.offset_x += delta_x
+        self.offset_y += delta_y
 
-        for _object in all_gameObjects:
-            _object.x -= delta_x
-            _object.y -= delta_y
-            _object.rect = pygame.Rect(_object.x, _object.y, _object.width, _object.height)
+    def save_position(self):
+        self.previous_offset = (self.offset_x, self.offset_y)
+
+    def draw_offset(self):
+        return (int(self.previous_offset[0] + (self.offset_x - self.previous_offset[0]) * self.alpha),
+                int(self.previous_offset[1] + (self.offset_y - self.previous_offset[1]) * self.alpha))
+
+    def to_world(self, x, y):
+        return x + self.offset_x, y + self.offset_y
+
+    def to_screen(self, x, y):
+        offset_x, offset_y = self.draw_offset()
+        return x - offset_x, y - offset_y
+
+    def room_position(self, x, y, delta_x, delta_y):
+        return self.to_world(x + (CAMERA_WIDTH - WIDTH) // 2 - self.x + WIDTH * delta_x,
+                             y + (CAMERA_HEIGHT - HEIGHT) // 2 - self.y - HEIGHT * delta_y)
+
+    def view(self):
+        return pygame.Rect(*self.draw_offset(), CAMERA_WIDTH, CAMERA_HEIGHT)
+
+
+class FixedTimestep:
+    """
+    Симуляция с постоянным шагом: время кадра накапливается (accumulator) и тратится шагами длины step,
+     поэтому медленный кадр не превращается в один огромный шаг (и пули не пролетают сквозь стены)
+    Если за кадр накопилось больше max_steps шагов, лишнее время выбрасывается, чтобы игра не отставала все сильнее
+    Attributes:
+        step: float
+            Длина шага симуляции в секундах
+        max_steps: int
+            Наибольшее количество шагов за кадр
+        accumulator: float
+            Накопленное, но еще не просимулированное время
+        alpha: float
+            accumulator / step - насколько отрисовка должна сдвинуть объекты от предыдущего шага к последнему
+        dropped: float
+            Сколько времени было выброшено из-за max_steps
+        tracked: list
+            Объекты, положение которых отрисовывается с интерполяцией (у них есть метод save_position)
+    Methods:
+        steps(frame_time)
+            Добавляет время кадра и возвращает, сколько шагов симуляции нужно сделать
+        track(*objects)
+            Добавляет объекты в tracked
+        save_positions()
+            Запоминает положения tracked в начале шага
+    """
+
+    def __init__(self, step=1 / 120, max_steps=8):
+        self.step, self.max_steps = step, max_steps
+        self.accumulator = 0
+        self.alpha = 1
+        self.dropped = 0
+        self.tracked = []
+
+    def steps(self, frame_time):
+        self.accumulator += frame_time
+        steps = int(self.accumulator / self.step)
+        if steps > self.max_steps:
+            self.dropped += (steps - self.max_steps) * self.step
+            steps = self.max_steps
+        self.accumulator = min(self.accumulator - steps * self.step, self.step)
+        self.alpha = self.accumulator / self.step
+        return steps
+
+    def track(self, *objects):
+        self.tracked.extend(objects)
+
+    def save_positions(self):
+        for _object in self.tracked:
+            _object.save_position()
+
+
+class PressedKeys(frozenset):
+    """Набор зажатых клавиш, который читается как результат pygame.key.get_pressed(): pressed[pygame.K_w]"""
+
+    def __getitem__(self, key):
+        return key in self
+
+
+class KeyboardInput:
+    """
+    Источник ввода для Character - клавиатура
+    Methods:
+        pressed()
+            Возвращает зажатые клавиши (pygame.key.get_pressed())
+    """
+
+    def pressed(self):
+        return pygame.key.get_pressed()
+
+
+class ScriptedInput:
+    """
+    Источник ввода для Character - заранее записанная временная шкала клавиш,
+     время берется по игровым часам (game_clock.now), поэтому не зависит от скорости симуляции
+    Attributes:
+        timeline: list
+            Список (время начала, PressedKeys), отсортированный по времени,
+             клавиши держатся до начала следующего отрезка
+        loop: float или None
+            Если задано, шкала повторяется с этим периодом
+        position: int
+            Индекс текущего отрезка шкалы
+    Methods:
+        pressed()
+            Возвращает клавиши, зажатые в текущий момент игрового времени
+        load(path, loop=None)
+            Читает шкалу из файла, каждая строка - "<время> <клавиша>,<клавиша>...",
+             клавиши - имена констант pygame без K_ (w, a, LEFT, UP), # - комментарий
+        wander(duration, period=0.5, seed=0)
+            Возвращает случайную, но воспроизводимую шкалу: каждые period секунд
+             новое направление движения и стрельбы
+    """
+
+    def __init__(self, timeline, loop=None):
+        self.timeline = sorted((start, PressedKeys(keys)) for start, keys in timeline)
+        self.loop = loop
+        self.position = 0
+
+    def pressed(self):
+        if not self.timeline:
+            return PressedKeys()
+        now = game_clock.now % self.loop if self.loop else game_clock.now
+        if now < self.timeline[self.position][0]:
+            self.position = 0
+        while self.position + 1 < len(self.timeline) and self.timeline[self.position + 1][0] <= now:
+            self.position += 1
+        start, keys = self.timeline[self.position]
+        return keys if start <= now else PressedKeys()
+
+    @staticmethod
+    def load(path, loop=None):
+        timeline = []
+        with open(path, encoding='utf-8') as file:
+            for line_number, line in enumerate(file, 1):
+                line = line.split('#', 1)[0].split()
+                if not line:
+                    continue
+                try:
+                    keys = [getattr(pygame, 'K_' + name) for name in ','.join(line[1:]).split(',') if name]
+                    timeline.append((float(line[0]), keys))
+                except (ValueError, AttributeError) as error:
+                    raise ValueError(f'{path}, строка {line_number}: {error}') from None
+        return ScriptedInput(timeline, loop)
+
+    @staticmethod
+    def wander(duration, period=0.5, seed=0):
+        generator = random.Random(seed)
+        moves = [[], [pygame.K_w], [pygame.K_a], [pygame.K_s], [pygame.K_d],
+                 [pygame.K_w, pygame.K_a], [pygame.K_w, pygame.K_d], [pygame.K_s, pygame.K_a], [pygame.K_s, pygame.K_d]]
+        shots = [[], [pygame.K_LEFT], [pygame.K_RIGHT], [pygame.K_UP], [pygame.K_DOWN]]
+        return ScriptedInput([(index * period, generator.choice(moves) + generator.choice(shots))
+                              for index in range(int(duration / period) + 1)], loop=duration)
+
+
+class ProfilerScope:
+    """Замер одного именованного участка кода: with profiler.scope(name): ..."""
+
+    def __init__(self, profiler, name):
+        self.profiler, self.name = profiler, name
+        self.started = 0
+
+    def __enter__(self):
+        self.started = perf_counter()
+
+    def __exit__(self, *exc_info):
+        duration = perf_counter() - self.started
+        self.profiler.add(self.name, duration)
+        if self.profiler.tracer is not None:
+            self.profiler.tracer.complete(self.name, self.started, duration)
+
+
+class NullScope:
+    """Пустой замер, который отдает выключенный Profiler"""
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class Profiler:
+    """
+    Профилировщик кадра: время именованных участков за кадр складывается,
+     а по окончании кадра попадает в скользящее окно последних window кадров
+    Выключенный профилировщик отдает один и тот же пустой замер, поэтому почти ничего не стоит
+    Attributes:
+        enabled: bool
+            Идут ли замеры
+        overlay: bool
+            Показывать ли замеры на экране (F3)
+        window: int
+            Сколько последних кадров хранится
+        samples: dict
+            Имя участка -> deque времени участка (в секундах) в последних кадрах
+        current: dict
+            Имя участка -> время участка в текущем кадре
+        frames: int
+            Сколько кадров было замерено
+        tracer: Tracer или None
+            Если задан, каждый замер и каждый кадр (frame) еще и записываются в шкалу Tracer
+        refresh: float
+            Как часто (в секундах) перерисовывается картинка overlay
+    Methods:
+        scope(name)
+            Возвращает контекстный менеджер, замеряющий участок name
+        add(name, seconds)
+            Добавляет время к участку name в текущем кадре
+        end_frame()
+            Заканчивает кадр: переносит current в samples
+        stats()
+            Возвращает словарь имя участка -> {'mean', 'p50', 'p95', 'p99', 'max'} в миллисекундах
+        histogram(name, bins=16)
+            Возвращает (количество кадров в каждом интервале, границы интервалов в миллисекундах)
+        toggle_overlay()
+            Включает или выключает overlay (и замеры вместе с ним)
+        draw(surface)
+            Рисует overlay в правом верхнем углу и возвращает его прямоугольник
+    """
+
+    NULL_SCOPE = NullScope()
+
+    def __init__(self, window=240, refresh=0.25):
+        self.enabled = False
+        self.overlay = False
+        self.window, self.refresh = window, refresh
+        self.samples = {}
+        self.current = {}
+        self.scopes = {}
+        self.frames = 0
+        self.tracer = None
+        self.frame_started = perf_counter()
+        self.image, self.drawn_at = None, -refresh
+
+    def scope(self, name):
+        if not self.enabled:
+            return self.NULL_SCOPE
+        scope = self.scopes.get(name)
+        if scope is None:
+            scope = self.scopes[name] = ProfilerScope(self, name)
+        return scope
+
+    def add(self, name, seconds):
+        self.current[name] = self.current.get(name, 0) + seconds
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        if self.tracer is not None:
+            now = perf_counter()
+            self.tracer.complete('frame', self.frame_started, now - self.frame_started)
+            self.frame_started = now
+        for name in self.samples.keys() | self.current.keys():
+            if name not in self.samples:
+                self.samples[name] = deque([0.0] * min(self.frames, self.window), maxlen=self.window)
+            self.samples[name].append(self.current.get(name, 0.0))
+        self.current = {}
+        self.frames += 1
+
+    def stats(self):
+        result = {}
+        for name, samples in sorted(self.samples.items()):
+            values = np.fromiter(samples, dtype=float, count=len(samples)) * 1000
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            result[name] = {'mean': round(float(values.mean()), 4), 'p50': round(float(p50), 4),
+                            'p95': round(float(p95), 4), 'p99': round(float(p99), 4),
+                            'max': round(float(values.max()), 4)}
+        return result
+
+    def histogram(self, name, bins=16):
+        counts, edges = np.histogram(np.fromiter(self.samples.get(name, ()), dtype=float) * 1000, bins=bins)
+        return counts, edges
+
+    def toggle_overlay(self):
+        self.overlay = not self.overlay
+        self.enabled = self.overlay or '--profile' in sys.argv or self.tracer is not None
+        self.drawn_at = -self.refresh
+
+    def draw(self, surface):
+        if perf_counter() - self.drawn_at >= self.refresh:
+            self.image = self._render()
+            self.drawn_at = perf_counter()
+        rect = self.image.get_rect(topright=(surface.get_width(), 0))
+        surface.blit(self.image, rect)
+        return rect
+
+    def _render(self):
+        stats = self.stats()
+        line_height, chart_width = font_pool.get(18).get_linesize(), 80
+        image = pygame.Surface((380, line_height * (len(stats) + 1) + 6))
+        image.fill(GameObject.FON_COLOR)
+        image.blit(text_cache.render(18, 'участок', GameObject.COLOR), (4, 3))
+        image.blit(text_cache.render(18, '  p50    p95 (мс)', GameObject.COLOR), (200, 3))
+        for row, (name, values) in enumerate(stats.items(), 1):
+            y = 3 + row * line_height
+            image.blit(text_cache.render(18, name, GameObject.COLOR), (4, y))
+            image.blit(text_cache.render(18, f'{values["p50"]:6.2f} {values["p95"]:6.2f}', GameObject.COLOR),
+                       (200, y))
+            counts, _ = self.histogram(name, bins=chart_width // 4)
+            if counts.max():
+                for index, count in enumerate(counts):
+                    height = max(1, int(count / counts.max() * (line_height - 4))) if count else 0
+                    pygame.draw.rect(image, GameObject.COLOR,
+                                     (380 - chart_width - 4 + index * 4, y + line_height - 2 - height, 3, height))
+        return image
+
+
+class TraceSpan:
+    """Участок, который Tracer записывает как событие с началом и длительностью"""
+
+    def __init__(self, tracer, name, args):
+        self.tracer, self.name, self.args = tracer, name, args
+        self.started = 0
+
+    def __enter__(self):
+        self.started = perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.tracer.complete(self.name, self.started, perf_counter() - self.started, self.args)
+
+
+class Tracer:
+    """
+    Запись временной шкалы в формате Chrome trace event (JSON), файл открывается в chrome://tracing или Perfetto
+    События копятся в буфере и дописываются в файл пачками по flush_every, поэтому память не растет
+     сколько бы ни длилась запись; события могут приходить из разных потоков (RoomPrefetcher)
+    Attributes:
+        enabled: bool
+            Идет ли запись (задан ли path)
+        path: str или None
+            Файл, в который пишется шкала
+        flush_every: int
+            Сколько событий копится в памяти перед записью в файл
+        buffer: list
+            Еще не записанные события
+        written: int
+            Сколько событий уже записано в файл
+        threads: set
+            Потоки, для которых уже записано имя
+    Methods:
+        span(name, **args)
+            Возвращает контекстный менеджер, записывающий участок name с аргументами args
+        complete(name, started, duration, args=None)
+            Записывает участок, начавшийся в started (perf_counter) и длившийся duration секунд
+        counter(name, **values)
+            Записывает значения счетчиков (например, количество объектов) в текущий момент
+        flush()
+            Дописывает буфер в файл
+        close()
+            Дописывает буфер и закрывает файл, после этого запись не идет
+    """
+
+    def __init__(self, path=None, flush_every=4096):
+        self.path, self.flush_every = path, flush_every
+        self.enabled = path is not None
+        self.buffer = []
+        self.written = 0
+        self.threads = set()
+        self.lock = threading.RLock()
+        self.origin = perf_counter()
+        self.pid = os.getpid()
+        self.gc_started = 0
+        if self.enabled:
+            self.file = open(path, 'w', encoding='utf-8')
+            self.file.write('[\n')
+            gc.callbacks.append(self._gc)
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return Profiler.NULL_SCOPE
+        return TraceSpan(self, name, args)
+
+    def complete(self, name, started, duration, args=None):
+        event = {'name': name, 'ph': 'X', 'ts': round((started - self.origin) * 1e6, 1),
+                 'dur': round(duration * 1e6, 1), 'pid': self.pid, 'tid': threading.get_ident()}
+        if args:
+            event['args'] = args
+        self._emit(event)
+
+    def counter(self, name, **values):
+        self._emit({'name': name, 'ph': 'C', 'ts': round((perf_counter() - self.origin) * 1e6, 1),
+                    'pid': self.pid, 'args': values})
+
+    def _emit(self, event):
+        with self.lock:
+            if not self.enabled:
+                return
+            if event.get('tid') is not None and event['tid'] not in self.threads:
+                self.threads.add(event['tid'])
+                self.buffer.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': event['tid'],
+                                    'args': {'name': threading.current_thread().name}})
+            self.buffer.append(event)
+            if len(self.buffer) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            events, self.buffer = self.buffer, []
+            if events:
+                self.file.write((',\n' if self.written else '') + ',\n'.join(map(json.dumps, events)))
+                self.written += len(events)
+
+    def _gc(self, phase, info):
+        if phase == 'start':
+            self.gc_started = perf_counter()
+        else:
+            self.complete('gc', self.gc_started, perf_counter() - self.gc_started,
+                          {'generation': info['generation'], 'collected': info['collected']})
+
+    def close(self):
+        if not self.enabled:
+            return
+        gc.callbacks.remove(self._gc)
+        with self.lock:
+            self.flush()
+            self.enabled = False
+            self.file.write('\n]\n')
+            self.file.close()
+
+
+class FrameInput:
+    """
+    Источник ввода для Character, клавиши которого меняются только между кадрами:
+     в начале кадра снимаются с source (capture) или берутся из записи (set_mask)
+    Attributes:
+        KEYS: list
+            Клавиши, которые читает Character, бит i маски - клавиша KEYS[i]
+        source: KeyboardInput, ScriptedInput или None
+            Откуда снимаются клавиши
+        mask: int
+            Маска зажатых клавиш текущего кадра
+    Methods:
+        capture()
+            Снимает клавиши с source и возвращает их маску
+        set_mask(mask)
+            Задает клавиши кадра маской
+        pressed()
+            Возвращает клавиши текущего кадра
+    """
+
+    KEYS = [pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN]
+
+    def __init__(self, source=None):
+        self.source = source
+        self.mask, self.keys = 0, PressedKeys()
+
+    def capture(self):
+        pressed = self.source.pressed()
+        self.set_mask(sum(1 << index for index, key in enumerate(self.KEYS) if pressed[key]))
+        return self.mask
+
+    def set_mask(self, mask):
+        if mask != self.mask:
+            self.mask = mask
+            self.keys = PressedKeys(key for index, key in enumerate(self.KEYS) if mask >> index & 1)
+
+    def pressed(self):
+        return self.keys
+
+
+class InputRecorder:
+    """
+    Запись партии для точного воспроизведения: зерно, длина шага симуляции, а затем по кадру на запись -
+     сколько шагов симуляции прошло в кадре, маска клавиш (FrameInput) и действия кадра
+     (смена оружия, пауза, создание ItemSpawner и AidKid мышью)
+    Каждые checkpoint_every кадров пишется контрольная сумма мира (world_checksum),
+     по которой InputReplay находит расхождение
+    Формат: заголовок HEADER, кадр FRAME и за ним ACTION (и координаты POSITION для создания объектов),
+     после каждого checkpoint_every-го кадра CHECKSUM
+    Attributes:
+        MAGIC, VERSION: bytes, int
+            Подпись и версия формата
+        WEAPON_CHANGE, PAUSE, ITEM_SPAWNER, AID_KIT: int
+            Коды действий
+        file: file
+            Файл записи
+        checkpoint_every: int
+            Как часто пишется контрольная сумма
+        frames: int
+            Сколько кадров записано
+    Methods:
+        frame(steps, mask, actions)
+            Записывает кадр, actions - список кортежей (код, x, y) или (код,)
+        end_frame()
+            Вызывается после симуляции кадра, пишет контрольную сумму, если пора
+        close()
+            Закрывает файл
+    """
+
+    MAGIC, VERSION = b'PGRP', 1
+    HEADER = struct.Struct('<4sHQdH')
+    FRAME = struct.Struct('<BBB')
+    ACTION = struct.Struct('<B')
+    POSITION = struct.Struct('<dd')
+    CHECKSUM = struct.Struct('<I')
+    WEAPON_CHANGE, PAUSE, ITEM_SPAWNER, AID_KIT = range(1, 5)
+
+    def __init__(self, path, seed, step, checkpoint_every=60):
+        self.file = open(path, 'wb')
+        self.checkpoint_every = checkpoint_every
+        self.frames = 0
+        self.file.write(self.HEADER.pack(self.MAGIC, self.VERSION, seed, step, checkpoint_every))
+
+    def frame(self, steps, mask, actions):
+        self.file.write(self.FRAME.pack(steps, mask, len(actions)))
+        for action in actions:
+            self.file.write(self.ACTION.pack(action[0]))
+            if action[0] in (self.ITEM_SPAWNER, self.AID_KIT):
+                self.file.write(self.POSITION.pack(action[1], action[2]))
+        self.frames += 1
+
+    def end_frame(self):
+        if self.frames % self.checkpoint_every == 0:
+            self.file.write(self.CHECKSUM.pack(world_checksum()))
+
+    def close(self):
+        self.file.close()
+
+
+class InputReplay:
+    """
+    Чтение записи InputRecorder
+    Attributes:
+        seed: int
+            Зерно записанной партии
+        step: float
+            Длина шага симуляции записанной партии
+        checkpoint_every: int
+            Как часто в записи встречается контрольная сумма
+        frames: int
+            Сколько кадров прочитано
+        checkpoints: int
+            Сколько контрольных сумм прочитано
+    Methods:
+        read_frame()
+            Возвращает (steps, mask, actions) следующего кадра или None, если запись кончилась
+        end_frame()
+            Вызывается после симуляции кадра, возвращает записанную контрольную сумму или None,
+             если для этого кадра ее нет
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = file.read()
+        magic, version, self.seed, self.step, self.checkpoint_every = InputRecorder.HEADER.unpack_from(self.data)
+        if magic != InputRecorder.MAGIC or version != InputRecorder.VERSION:
+            raise ValueError(f'{path} - не запись ввода (или другой версии)')
+        self.position = InputRecorder.HEADER.size
+        self.frames = self.checkpoints = 0
+
+    def read(self, structure):
+        values = structure.unpack_from(self.data, self.position)
+        self.position += structure.size
+        return values
+
+    def read_frame(self):
+        if self.position >= len(self.data):
+            return None
+        steps, mask, count = self.read(InputRecorder.FRAME)
+        actions = []
+        for _ in range(count):
+            code, = self.read(InputRecorder.ACTION)
+            if code in (InputRecorder.ITEM_SPAWNER, InputRecorder.AID_KIT):
+                actions.append((code, *self.read(InputRecorder.POSITION)))
+            else:
+                actions.append((code,))
+        self.frames += 1
+        return steps, mask, actions
+
+    def end_frame(self):
+        if self.frames % self.checkpoint_every:
+            return None
+        self.checkpoints += 1
+        return self.read(InputRecorder.CHECKSUM)[0]
+
+
+# Слои отрисовки, объекты с меньшим слоем рисуются раньше (ниже)
+LAYER_FLOOR, LAYER_WALLS, LAYER_ACTORS, LAYER_PROJECTILES, LAYER_HUD = range(5)
+
+
+class CameraGroup(pygame.sprite.LayeredUpdates):
+    """
+    Группа спрайтов, которая рисует спрайты по слоям со сдвигом камеры
+     и пропускает спрайты, не попадающие на экран
+    Слой спрайта берется из атрибута _layer (LAYER_FLOOR, LAYER_WALLS, LAYER_ACTORS),
+     слои, которые рисуются не спрайтами (пули, надписи), подключаются через set_renderer
+    Attributes:
+        spatial_index: SpatialHash или None
+            Если задан, кандидаты на отрисовку берутся из ячеек сетки, попадающих на экран,
+             а не перебором всех спрайтов группы
+        renderers: dict
+            Словарь, ключ - слой, значение - функция renderer(surface, camera, dirty), рисующая этот слой,
+             может вернуть пару (сколько нарисовано, сколько пропущено)
+        hidden_layers: set
+            Слои, спрайты которых не рисуются (например, стены, заранее нарисованные в StaticLayer)
+        blits_issued: int
+            Сколько объектов было нарисовано за последний кадр
+        blits_skipped: int
+            Сколько объектов было пропущено за последний кадр, так как они не видны камере
+    Methods:
+        set_renderer(layer, renderer)
+            Подключает функцию, которая рисует слой layer
+        draw(surface, camera, dirty=None)
+            Рисует на surface по слоям все видимые камерой спрайты группы и подключенные слои,
+             если передан список dirty, добавляет в него экранные прямоугольники всего нарисованного
+        stats()
+            Возвращает словарь со статистикой отрисовки последнего кадра
+    """
+
+    def __init__(self, *sprites, spatial_index=None):
+        pygame.sprite.LayeredUpdates.__init__(self, *sprites)
+        self.spatial_index = spatial_index
+        self.renderers = {}
+        self.hidden_layers = set()
+        self.blits_issued, self.blits_skipped = 0, 0
+
+    def update(self, *args):
+        if not profiler.enabled:
+            return super().update(*args)
+        for sprite in self.sprites():
+            started = perf_counter()
+            sprite.update(*args)
+            profiler.add('update.' + type(sprite).__name__, perf_counter() - started)
+
+    def set_renderer(self, layer, renderer):
+        self.renderers[layer] = renderer
+
+    def draw(self, surface, camera, dirty=None):
+        view = camera.view()
+        offset_x, offset_y = view.x, view.y
+        alpha = camera.alpha
+        layers, hidden_layers = self._spritelayers, self.hidden_layers
+        if self.spatial_index is None:
+            candidates = self._spritelist
+        else:
+            # Спрайт может быть больше своей коллизии, поэтому берем на одну ячейку больше
+            size = self.spatial_index.cell_size
+            candidates = sorted((game_object for game_object in
+                                 self.spatial_index.objects(view.x - size, view.y - size,
+                                                            view.width + 2 * size, view.height + 2 * size)
+                                 if game_object in layers), key=lambda sprite: (layers[sprite], id(sprite)))
+
+        renderers = sorted(self.renderers.items())
+        issued, skipped = 0, len(layers)
+        blits, k = [], 0
+        for sprite in candidates:
+            layer = layers[sprite]
+            while k < len(renderers) and renderers[k][0] < layer:
+                self._blits(surface, blits, dirty)
+                issued, skipped = issued + len(blits), skipped - len(blits)
+                blits = []
+                issued, skipped = self._render(renderers[k][1], surface, camera, dirty, issued, skipped)
+                k += 1
+            if layer in hidden_layers:
+                continue
+            rect = sprite.rect
+            if view.colliderect(rect):
+                previous = sprite.previous_position
+                if previous is None:
+                    blits.append((sprite.image, (rect.x - offset_x, rect.y - offset_y)))
+                else:
+                    blits.append((sprite.image, (int(previous[0] + (sprite.x - previous[0]) * alpha) - offset_x,
+                                                 int(previous[1] + (sprite.y - previous[1]) * alpha) - offset_y)))
+        self._blits(surface, blits, dirty)
+        issued, skipped = issued + len(blits), skipped - len(blits)
+        for layer, renderer in renderers[k:]:
+            issued, skipped = self._render(renderer, surface, camera, dirty, issued, skipped)
+
+        self.blits_issued, self.blits_skipped = issued, skipped
+
+    @staticmethod
+    def _blits(surface, blits, dirty):
+        if dirty is None:
+            surface.blits(blits, doreturn=False)
+        else:
+            dirty.extend(surface.blits(blits))
+
+    @staticmethod
+    def _render(renderer, surface, camera, dirty, issued, skipped):
+        result = renderer(surface, camera, dirty)
+        if result is not None:
+            issued += result[0]
+            skipped += result[1]
+        return issued, skipped
+
+    def stats(self):
+        return {'issued': self.blits_issued, 'skipped': self.blits_skipped, 'sprites': len(self)}
+
+
+class StaticLayer:
+    """
+    Заранее нарисованные клетки поля: фон и стены (PatternPlatform) каждой клетки рисуются
+     в одну Surface размером WIDTH x HEIGHT, когда клетка создается, поэтому стены не нужно рисовать
+     по одной каждый кадр, а экран не нужно заливать фоном
+    Attributes:
+        rooms: OrderedDict
+            Кэш нарисованных клеток, ключ - номер клетки, значение - Surface,
+             старые клетки вытесняются, кроме загруженных сейчас (positions)
+        max_rooms: int
+            Сколько клеток хранить в кэше (загруженные сейчас клетки хранятся сверх этого)
+        positions: dict
+            Мировые координаты левого верхнего угла загруженных сейчас клеток
+    Methods:
+        load(key, cell, x, y)
+            Рисует клетку cell (если ее еще нет в кэше) и ставит ее в мировые координаты (x, y)
+        unload(key)
+            Убирает загруженную клетку key (кэш остается)
+        clear()
+            Убирает все загруженные клетки (кэш остается)
+        draw(surface, camera, area=None)
+            Рисует видимые части загруженных клеток, если задан area - только внутри этого
+             экранного прямоугольника, возвращает (сколько нарисовано, сколько пропущено)
+    """
+
+    def __init__(self, max_rooms=12):
+        self.rooms = OrderedDict()
+        self.max_rooms = max_rooms
+        self.positions = {}
+
+    def load(self, key, cell, x, y):
+        if key in self.rooms:
+            self.rooms.move_to_end(key)
+        else:
+            self.rooms[key] = self.render(cell)
+        self.positions[key] = (int(x), int(y))
+        # Загруженные клетки не вытесняются, даже если их давно не загружали заново (они так и остались на экране)
+        while len(self.rooms) > self.max_rooms:
+            stale = next((old for old in self.rooms if old not in self.positions), None)
+            if stale is None:
+                break
+            del self.rooms[stale]
+
+    @staticmethod
+    def render(cell):
+        image = pygame.Surface((WIDTH, HEIGHT)).convert()
+        image.fill(GameObject.FON_COLOR)
+        for pattern, chance in cell:
+            if not isinstance(pattern, PatternPlatform) or chance != 1:
+                continue
+            if pattern.image is None:
+                pygame.draw.rect(image, GameObject.COLOR, (pattern.x, pattern.y, pattern.width, pattern.height))
+            else:
+                image.blit(load_image(pattern.image, GameObject.FON_COLOR), (pattern.x, pattern.y))
+        return image
+
+    def unload(self, key):
+        self.positions.pop(key, None)
+
+    def clear(self):
+        self.positions.clear()
+
+    def draw(self, surface, camera, area=None):
+        if area is None:
+            area = surface.get_rect()
+        offset_x, offset_y = camera.draw_offset()
+        issued = 0
+        for key, (x, y) in self.positions.items():
+            rect = area.clip(pygame.Rect(x - offset_x, y - offset_y, WIDTH, HEIGHT))
+            if rect.width and rect.height:
+                surface.blit(self.rooms[key], rect, rect.move(offset_x - x, offset_y - y))
+                issued += 1
+        return issued, len(self.positions) - issued
+
+
+class DirtyRectRenderer:
+    """
+    Режим отрисовки, при котором обновляются только изменившиеся части экрана
+    Пока камера стоит на месте, под объектами прошлого кадра восстанавливается фон из StaticLayer,
+     объекты рисуются заново, а на экран выводятся только их старые и новые прямоугольники;
+     если камера сдвинулась, перерисовывается весь экран (без заливки фоном - ее заменяет StaticLayer)
+    Attributes:
+        group: CameraGroup
+            Группа, которая рисует динамические объекты, стены в ней должны быть скрыты (hidden_layers)
+        static_layer: StaticLayer
+            Заранее нарисованные клетки
+        max_rects: int
+            Если прямоугольников больше, выводится весь экран
+        previous: list
+            Прямоугольники, нарисованные в прошлом кадре
+        offset: tuple
+            Сдвиг камеры в прошлом кадре
+    Methods:
+        invalidate()
+            Заставляет перерисовать весь экран в следующем кадре
+        draw(surface, camera)
+            Рисует кадр и возвращает список прямоугольников для pygame.display.update
+    """
+
+    def __init__(self, group, static_layer, max_rects=256):
+        self.group = group
+        self.static_layer = static_layer
+        self.max_rects = max_rects
+        self.previous = []
+        self.offset = None
+
+    def invalidate(self):
+        self.offset = None
+
+    def draw(self, surface, camera):
+        offset = camera.draw_offset()
+        dirty = []
+        if offset != self.offset:
+            self.offset = offset
+            self.static_layer.draw(surface, camera)
+            self.group.draw(surface, camera, dirty)
+            screen_rect = surface.get_rect()
+            self.previous = [rect.clip(screen_rect) for rect in dirty if screen_rect.colliderect(rect)]
+            return [screen_rect]
+
+        screen_rect = surface.get_rect()
+        for rect in self.previous:
+            self.static_layer.draw(surface, camera, rect)
+        self.group.draw(surface, camera, dirty)
+        dirty = [rect.clip(screen_rect) for rect in dirty if screen_rect.colliderect(rect)]
+        rects = self.previous + dirty
+        self.previous = dirty
+        if len(rects) > self.max_rects:
+            return [screen_rect]
+        return rects
+
+
+class Cell(list):
+    """
+    Клетка поля - список пар [паттерн объекта, шанс создания], после первого посещения шанс равен 1
+     (объект создается) или 0 (объект не создается)
+    Клетка, вытесненная из памяти, хранится в виде записи record: номер паттерна и битовая маска
+     создаваемых объектов (encode), из которой клетку можно восстановить (decode)
+    Attributes:
+        pattern_id: int или None
+            Номер паттерна клетки в WorldGenerator.patterns (None - начальная клетка)
+    Methods:
+        encode()
+            Возвращает запись клетки (bytes)
+        decode(record, patterns)
+            Восстанавливает клетку из записи
+    """
+    NO_PATTERN = 0xFFFF
+
+    def __init__(self, objects=(), pattern_id=None):
+        list.__init__(self, objects)
+        self.pattern_id = pattern_id
+
+    def encode(self):
+        mask = 0
+        for index, (pattern, chance) in enumerate(self):
+            if chance == 1:
+                mask |= 1 << index
+        pattern_id = Cell.NO_PATTERN if self.pattern_id is None else self.pattern_id
+        return struct.pack('<H', pattern_id) + mask.to_bytes((len(self) + 7) // 8, 'little')
+
+    @staticmethod
+    def decode(record, patterns):
+        pattern_id = struct.unpack_from('<H', record)[0]
+        if pattern_id == Cell.NO_PATTERN:
+            return Cell()
+        mask = int.from_bytes(record[2:], 'little')
+        return Cell(([pattern, (mask >> index) & 1] for index, (pattern, chance) in enumerate(patterns[pattern_id])),
+                    pattern_id)
+
+
+class PatternError(Exception):
+    """Ошибка в файле клетки, в тексте ошибки указаны файл и строка"""
+
+    def __init__(self, message, file=None, line=None):
+        self.message, self.file, self.line = message, file, line
+        Exception.__init__(self, message if file is None else f'{file}, строка {line}: {message}')
+
+
+class Expression:
+    """
+    Арифметическое выражение из аргумента паттерна (например, WIDTH // 2 - 100), которое разбирается
+     один раз в дерево замыканий, а потом вычисляется с любыми значениями констант без eval
+    Допустимы целые и дробные числа, имена констант, скобки, унарный минус и операции +, -, *, //
+    Attributes:
+        text: str
+            Исходный текст выражения
+        names: frozenset
+            Имена констант, которые используются в выражении
+        cache: dict
+            Общий кэш разобранных выражений, ключ - текст
+    Methods:
+        compile(text, names)
+            Возвращает разобранное выражение text (из кэша, если оно уже разбиралось),
+             names - допустимые имена констант, при ошибке вызывает PatternError
+        __call__(constants)
+            Вычисляет выражение, constants - словарь значений констант, при делении на ноль вызывает PatternError
+    """
+    TOKEN = re.compile(r'\s*(?:(\d+\.\d*|\.\d+|\d+)|(//|[-+*()])|([A-Za-z_]\w*))')
+    OPERATIONS = {'+': operator.add, '-': operator.sub, '*': operator.mul, '//': operator.floordiv}
+    cache = {}
+
+    def __init__(self, text, function, names):
+        self.text, self.function, self.names = text, function, names
+
+    def __call__(self, constants):
+        try:
+            return self.function(constants)
+        except ZeroDivisionError:
+            raise PatternError(f"деление на ноль в выражении '{self.text}'") from None
+
+    @staticmethod
+    def compile(text, names=()):
+        expression = Expression.cache.get(text)
+        if expression is None:
+            tokens = Expression._tokenize(text)
+            function, position, used = Expression._parse_sum(text, tokens, 0)
+            if position != len(tokens):
+                raise PatternError(f"лишний символ '{tokens[position][1]}' в выражении '{text}'")
+            expression = Expression.cache[text] = Expression(text, function, frozenset(used))
+
+        unknown = expression.names - set(names)
+        if unknown:
+            raise PatternError(f"неизвестная константа {', '.join(sorted(unknown))} в выражении '{text}'")
+        return expression
+
+    @staticmethod
+    def _tokenize(text):
+        tokens, position = [], 0
+        text = text.rstrip()
+        while position < len(text):
+            match = Expression.TOKEN.match(text, position)
+            if match is None or match.end() == position:
+                raise PatternError(f"недопустимый символ '{text[position:].strip()[:1]}' в выражении '{text}'")
+            number, sign, name = match.groups()
+            if number is not None:
+                tokens.append(('number', float(number) if '.' in number else int(number)))
+            elif sign is not None:
+                tokens.append(('sign', sign))
+            else:
+                tokens.append(('name', name))
+            position = match.end()
+        return tokens
+
+    # Каждый _parse_* возвращает (функция, позиция следующего токена, использованные имена),
+    #  если в части выражения нет констант, она вычисляется сразу (функция возвращает готовое число)
+    @staticmethod
+    def _parse_sum(text, tokens, position):
+        left, position, used = Expression._parse_product(text, tokens, position)
+        while position < len(tokens) and tokens[position][1] in ('+', '-'):
+            sign = tokens[position][1]
+            right, position, right_used = Expression._parse_product(text, tokens, position + 1)
+            left, used = Expression._binary(text, sign, left, right, used, right_used), used | right_used
+        return left, position, used
+
+    @staticmethod
+    def _parse_product(text, tokens, position):
+        left, position, used = Expression._parse_unary(text, tokens, position)
+        while position < len(tokens) and tokens[position][1] in ('*', '//'):
+            sign = tokens[position][1]
+            right, position, right_used = Expression._parse_unary(text, tokens, position + 1)
+            left, used = Expression._binary(text, sign, left, right, used, right_used), used | right_used
+        return left, position, used
+
+    @staticmethod
+    def _parse_unary(text, tokens, position):
+        if position < len(tokens) and tokens[position][1] in ('+', '-'):
+            sign = tokens[position][1]
+            operand, position, used = Expression._parse_unary(text, tokens, position + 1)
+            if sign == '+':
+                return operand, position, used
+            if not used:
+                value = -operand(None)
+                return (lambda constants: value), position, used
+            return (lambda constants: -operand(constants)), position, used
+        return Expression._parse_atom(text, tokens, position)
+
+    @staticmethod
+    def _parse_atom(text, tokens, position):
+        if position >= len(tokens):
+            raise PatternError(f"выражение '{text}' оборвалось")
+        kind, value = tokens[position]
+        if kind == 'number':
+            return (lambda constants: value), position + 1, set()
+        if kind == 'name':
+            return (lambda constants: constants[value]), position + 1, {value}
+        if value == '(':
+            function, position, used = Expression._parse_sum(text, tokens, position + 1)
+            if position >= len(tokens) or tokens[position][1] != ')':
+                raise PatternError(f"не закрыта скобка в выражении '{text}'")
+            return function, position + 1, used
+        raise PatternError(f"неожиданный символ '{value}' в выражении '{text}'")
+
+    @staticmethod
+    def _binary(text, sign, left, right, used, right_used):
+        operation = Expression.OPERATIONS[sign]
+        if not used and not right_used:
+            try:
+                value = operation(left(None), right(None))
+            except ZeroDivisionError:
+                raise PatternError(f"деление на ноль в выражении '{text}'")
+            return lambda constants: value
+        return lambda constants: operation(left(constants), right(constants))
+
+
+class PatternStore:
+    """
+    Загрузчик паттернов клеток из data/cells
+    Текстовые файлы клеток разбираются один раз и сохраняются в скомпилированном файле (compiled) -
+     списке уже вычисленных записей (шанс, название паттерна, аргументы), сохраненном через marshal,
+     поэтому при следующих запусках файл читается целиком без разбора текста и eval
+    Скомпилированный файл (и кэш в памяти) используется, только если не изменились версия формата,
+     константы (WIDTH, HEIGHT) и время изменения файлов клеток, иначе записи вычисляются заново
+    Числовые аргументы разбираются в Expression, разобранные файлы (шаблоны) хранятся в templates,
+     поэтому при смене констант (например, разрешения) выражения только вычисляются заново
+    Собрать скомпилированный файл вручную: python main.py --compile-cells
+    Attributes:
+        directory: str
+            Папка с текстовыми файлами клеток
+        compiled: str
+            Путь к скомпилированному файлу
+        constants: dict
+            Константы, которые можно использовать в аргументах паттернов
+        instructions: dict
+            Ключ - название паттерна, значение - типы его аргументов
+        cache: dict
+            Общий кэш загруженных клеток, ключ - папка, значение - (signature, клетки)
+        templates: dict
+            Общий кэш разобранных файлов клеток, ключ - папка, значение - (файлы и время их изменения, шаблоны),
+             шаблон - (шанс, название паттерна, аргументы, файл, строка), в котором числовые аргументы - Expression
+    Methods:
+        load()
+            Возвращает список клеток, каждая клетка - список записей (шанс, название паттерна, аргументы)
+        build()
+            Разбирает файлы клеток и перезаписывает скомпилированный файл, возвращает клетки
+        signature()
+            Возвращает то, от чего зависит результат разбора (версия, константы, файлы и время их изменения)
+        read_templates(sources)
+            Возвращает шаблоны клеток, разбирает только изменившиеся наборы файлов
+        evaluate(template)
+            Вычисляет выражения шаблона с текущими константами и возвращает запись,
+             при ошибке вызывает PatternError с файлом и строкой шаблона
+        read_cell(cell, file, line)
+            Разбирает строку cell (строка line файла file) в шаблон, при ошибке вызывает PatternError
+    """
+    VERSION = 1
+    instructions = {'PatternPlatform': [float, float, float, float, [float], [str], [str]],
+                    'PatternEnemy1': [float, float],
+                    'PatternEnemy2': [float, float, float],
+                    'PatternAidKid': [float, float],
+                    'PatternSpikes': [float, float, float, float, str],
+                    'PatternItemSpawner': [float, float]}
+    cache = {}
+    templates = {}
+
+    def __init__(self, constants, directory='data/cells', compiled='data/cells.bin'):
+        self.directory, self.compiled = directory, compiled
+        self.constants = dict(constants)
+
+    def signature(self):
+        return (PatternStore.VERSION, marshal.version, tuple(sorted(self.constants.items())),
+                tuple((name, os.stat(os.path.join(self.directory, name)).st_mtime_ns)
+                      for name in sorted(os.listdir(self.directory))))
+
+    def load(self):
+        signature = self.signature()
+        cached = PatternStore.cache.get(self.directory)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        cells = self._read_compiled(signature)
+        if cells is None:
+            cells = self._write(signature)
+        PatternStore.cache[self.directory] = (signature, cells)
+        return cells
+
+    def build(self):
+        signature = self.signature()
+        cells = self._write(signature)
+        PatternStore.cache[self.directory] = (signature, cells)
+        return cells
+
+    def _read_compiled(self, signature):
+        try:
+            with open(self.compiled, 'rb') as f:
+                compiled_signature, cells = marshal.loads(f.read())
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if compiled_signature != signature:
+            return None
+        return cells
+
+    def _write(self, signature):
+        cells = [[self.evaluate(template) for template in cell] for cell in self.read_templates(signature[3])]
+
+        # Файл пишется во временный и подменяется целиком, чтобы не оставить наполовину записанный файл
+        try:
+            with open(self.compiled + '.tmp', 'wb') as f:
+                f.write(marshal.dumps((signature, cells)))
+            os.replace(self.compiled + '.tmp', self.compiled)
+        except OSError:
+            pass
+        return cells
+
+    def read_templates(self, sources):
+        cached = PatternStore.templates.get(self.directory)
+        if cached is not None and cached[0] == sources:
+            return cached[1]
+
+        cells = []
+        for name, mtime in sources:
+            with open(os.path.join(self.directory, name)) as f:
+                cells.append([self.read_cell(line, name, number) for number, line in enumerate(f, 1)
+                              if line.strip()])
+        PatternStore.templates[self.directory] = (sources, cells)
+        return cells
+
+    def evaluate(self, template):
+        chance, name, args, file, line = template
+        try:
+            return chance, name, tuple(self._value(arg) for arg in args)
+        except PatternError as error:
+            raise PatternError(error.message, file, line) from None
+
+    def _value(self, arg):
+        if isinstance(arg, Expression):
+            return arg(self.constants)
+        if isinstance(arg, list):
+            return [self._value(i) for i in arg]
+        return arg
+
+    def read_arg(self, arg, pattern, n):
+        if arg == 'None':
+            return None
+
+        if pattern[n] is float:
+            return Expression.compile(arg, self.constants)
+
+        if pattern[n] is str:
+            return arg
+
+        if type(pattern[n]) == list:
+            arg = arg.split(',')
+            for i in range(len(arg)):
+                if arg[i] == 'None':
+                    arg[i] = None
+
+                elif pattern[n][i % len(pattern[n])] is int:
+                    arg[i] = Expression.compile(arg[i], self.constants)
+
+                elif pattern[n][0] is str:
+                    pass
+
+            return arg
+
+    def read_cell(self, cell, file=None, line=None):
+        cell = cell.split('|')
+        try:
+            if len(cell) < 2:
+                raise PatternError('ожидается "шанс|название паттерна|аргументы"')
+            if cell[1] not in PatternStore.instructions:
+                raise PatternError(f"неизвестный паттерн '{cell[1]}'")
+            if len(cell) - 2 != len(PatternStore.instructions[cell[1]]):
+                raise PatternError(f'{cell[1]} ожидает аргументов: {len(PatternStore.instructions[cell[1]])}, '
+                                   f'передано: {len(cell) - 2}')
+            try:
+                chance = float(cell[0])
+            except ValueError:
+                raise PatternError(f"шанс '{cell[0]}' не число")
+            return (chance, cell[1],
+                    tuple(self.read_arg(arg.strip(), PatternStore.instructions[cell[1]], i)
+                          for i, arg in enumerate(cell[2:])), file, line)
+        except PatternError as error:
+            raise PatternError(error.message, file, line) from None
+
+
+class RoomPrefetcher:
+    """
+    Фоновый поток, который заранее готовит клетки, к которым подходит игрок:
+     выбирает паттерн и бросает шансы создания объектов,
+     главному потоку остается только создать объекты (это нельзя делать не в главном потоке,
+     так как группы спрайтов pygame не потокобезопасны)
+    Attributes:
+        generate: function
+            Функция generate(key), возвращающая готовую клетку key
+        max_ready: int
+            Сколько готовых клеток хранить, самые старые выбрасываются
+        ready: OrderedDict
+            Готовые клетки, ключ - номер клетки, значение - Cell
+        requested: set
+            Клетки, которые уже запрошены (в очереди, готовятся или готовы)
+        prepared: int
+            Сколько клеток подготовлено потоком
+        taken: int
+            Сколько подготовленных клеток было использовано
+    Methods:
+        request(key)
+            Ставит клетку key в очередь на подготовку (если она еще не запрошена)
+        take(key)
+            Возвращает готовую клетку key и забывает ее, если клетка не готова - None
+        stop()
+            Останавливает поток
+        stats()
+            Возвращает словарь со счетчиками
+    """
+
+    def __init__(self, generate, max_ready=32):
+        self.generate = generate
+        self.max_ready = max_ready
+        self.ready = OrderedDict()
+        self.requested = set()
+        self.prepared = self.taken = 0
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._work, name='RoomPrefetcher', daemon=True)
+        self.thread.start()
+
+    def _work(self):
+        while True:
+            key = self.queue.get()
+            if key is None:
+                break
+            cell = self.generate(key)
+            with self.lock:
+                self.ready[key] = cell
+                self.prepared += 1
+                while len(self.ready) > self.max_ready:
+                    self.requested.discard(self.ready.popitem(last=False)[0])
+
+    def request(self, key):
+        with self.lock:
+            if key in self.requested:
+                return
+            self.requested.add(key)
+        self.queue.put(key)
+
+    def take(self, key):
+        with self.lock:
+            cell = self.ready.pop(key, None)
+            if cell is not None:
+                self.requested.discard(key)
+                self.taken += 1
+            return cell
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        return {'prepared': self.prepared, 'taken': self.taken, 'ready': len(self.ready),
+                'queued': self.queue.qsize()}
 
 
 class WorldGenerator:
     """
     Класс WorldGenerator создает, отрисовывае и изменяет игровое поле
+    Загружены (имеют объекты в игре) только 9 клеток вокруг игрока, при переходе в соседнюю клетку
+     выгружается только уходящая полоса клеток и загружается только новая
     Attributes:
          _camera: Camera
             Позиция игрока будет считаться с помощью этой камеры
-        cell: list * list
-            Игровое поле, каждый элемент которого представляет одну клетку,
-            каждый элемент одной клетки - это объект и шанс создания этого объекта
+        static_layer: StaticLayer или None
+            Если задан, при создании клеток их стены рисуются в StaticLayer
+        max_rooms: int
+            Сколько посещенных клеток хранить в cells, остальные сжимаются в records (не меньше 9)
+        cells: OrderedDict
+            Игровое поле, ключ - номер клетки (по оси абсцисс, по оси ординат), значение - Cell,
+             давно не посещенные клетки находятся в начале
+            Клетки создаются, только когда игрок подходит к ним, поэтому поле не нужно расширять
+        records: dict
+            Вытесненные из cells клетки, ключ - номер клетки, значение - запись Cell.encode()
+        loaded: dict
+            Загруженные клетки, ключ - номер клетки, значение - список созданных в ней объектов
+        pending: OrderedDict
+            Загруженные клетки, объекты которых еще не созданы, ключ - номер клетки,
+             значение - список оставшихся пар (номер паттерна в клетке, паттерн)
+        attach_budget: float или None
+            Сколько секунд за кадр можно тратить на создание объектов из pending (None - без ограничения)
+        attach_limit: int или None
+            Сколько объектов из pending можно создать за кадр, если задано, заменяет attach_budget
+             (при записи и воспроизведении ввода, когда результат не должен зависеть от скорости машины)
+        seed: int
+            Зерно поля, клетка key всегда получает один и тот же паттерн и результаты бросков шансов,
+             независимо от того, подготовил ли ее RoomPrefetcher или главный поток
+        prefetcher: RoomPrefetcher или None
+            Поток, заранее готовящий клетки, к краю которых подходит игрок
+        prefetch_margin: tuple
+            Расстояние до края клетки (по оси абсцисс, по оси ординат), с которого начинается подготовка
         patterns: list
             Список всех возможных видов клеток
         character_cell: list
-            Показывает в какой клетке находится игрок
+            Показывает в какой клетке находится игрок (клетка, с которой начинается игра, - (0, 0))
+        max_distance: int
+            Наибольшее удаление игрока от начальной клетки в клетках (по большей из осей)
     Methods:
         new_cell():
-            Уничтожает объекты, которые находятся вне клеток, которые окружают игрока
-            Создает объекты, которые находятся в клетках окружающих игрока
-            Случайно выбирает новые паттерны для новых клеток (в которых раньше не бал игрок)
-            При выходе за пределы поля, расширяет поле на один слой во все стороны
+            Выгружает клетки, которые больше не окружают игрока, и загружает новые окружающие клетки
+            Уничтожает объекты, которые не принадлежат ни одной клетке (кроме Indestructible)
+        cell(key)
+            Возвращает клетку key, восстанавливает ее из записи, берет у prefetcher или,
+             если игрок в ней раньше не был, создает ее (generate_cell)
+        generate_cell(key)
+            Случайно выбирает паттерн новой клетки key и бросает шансы ее объектов,
+             не меняет состояние WorldGenerator, поэтому может вызываться из RoomPrefetcher
+        prefetch()
+            Если игрок подошел к краю клетки, просит prefetcher подготовить клетки за этим краем
+        load_cell(key)
+            Ставит объекты клетки key в очередь на создание (pending)
+        attach(budget, limit=None)
+            Создает объекты из pending, пока не истечет budget секунд или не будет создано limit объектов
+             (None - без ограничения)
+        unload_cell(key)
+            Уничтожает объекты клетки key
+        forget(slot)
+            Убирает из клетки паттерн, создавший объект (slot - GameObject.slot), чтобы объект больше не появлялся
+        stats()
+            Возвращает словарь с количеством загруженных, хранимых и сжатых клеток
     """
 
-    def __init__(self, _camera):
-        self.cells = [[[[PatternPlatform(300, 200, 500, 200, None,
-                                         ['Wall'], ['Wall']), 0]]]]
+    def __init__(self, _camera, static_layer=None, max_rooms=64, prefetch=True, attach_budget=0.004):
+        self.static_layer = static_layer
+        self.max_rooms = max(max_rooms, 9)
+        self.attach_budget = attach_budget
+        self.attach_limit = None
+        self.cells = OrderedDict({(0, 0): Cell([[PatternPlatform(300, 200, 500, 200, None,
+                                                                 ['Wall'], ['Wall']), 0]])})
+        self.records = {}
+        self.loaded = {}
+        self.pending = OrderedDict()
+        self.seed = random.getrandbits(32)
         self.patterns = []
         self.constants = {'WIDTH': WIDTH, 'HEIGHT': HEIGHT}
-        self.instruction_for_patterns = {'PatternPlatform': [PatternPlatform, float, float, float,
-                                                             float, [float], [str], [str]],
-                                         'PatternEnemy1': [PatternEnemy1, float, float],
-                                         'PatternEnemy2': [PatternEnemy2, float, float, float],
-                                         'PatternAidKid': [PatternAidKid, float, float],
-                                         'PatternSpikes': [PatternSpikes, float, float, float, float, str],
-                                         'PatternItemSpawner': [PatternItemSpawner, float, float]}
-
-        for file in os.listdir('data/cells'):
-            f = open('data/cells/' + file)
-            pattern = []
-            for _object in f.readlines():
-                pattern.append(self.read_cell(_object))
-            self.patterns.append(pattern)
+        self.instruction_for_patterns = {'PatternPlatform': PatternPlatform, 'PatternEnemy1': PatternEnemy1,
+                                         'PatternEnemy2': PatternEnemy2, 'PatternAidKid': PatternAidKid,
+                                         'PatternSpikes': PatternSpikes, 'PatternItemSpawner': PatternItemSpawner}
+
+        for cell in PatternStore(self.constants).load():
+            self.patterns.append([[self.instruction_for_patterns[name](*args), chance] for chance, name, args in cell])
 
         self.character_cell = [0, 0]
+        self.max_distance = 0
         self.camera = _camera
+        self.prefetch_margin = (WIDTH // 4, HEIGHT // 4)
+        self.prefetcher = RoomPrefetcher(self.generate_cell) if prefetch else None
         self.new_cell()
+        self.attach(None)
 
+    # Камера сдвигается ровно на размер клетки, поэтому мировые координаты клеток не меняются
+    #  и уже загруженные клетки не нужно пересоздавать
     def update(self):
         if self.camera.x > WIDTH // 2:
             self.character_cell[0] += 1
-            self.camera.x = -WIDTH // 2
+            self.camera.x -= WIDTH
             self.new_cell()
         elif self.camera.x < -WIDTH // 2:
             self.character_cell[0] -= 1
-            self.camera.x = WIDTH // 2
+            self.camera.x += WIDTH
             self.new_cell()
 
         if self.camera.y > HEIGHT // 2:
             self.character_cell[1] -= 1
-            self.camera.y = -HEIGHT // 2
+            self.camera.y -= HEIGHT
             self.new_cell()
         elif self.camera.y < -HEIGHT // 2:
             self.character_cell[1] += 1
-            self.camera.y = HEIGHT // 2
+            self.camera.y += HEIGHT
             self.new_cell()
 
+        if self.prefetcher is not None:
+            self.prefetch()
+        with profiler.scope('world.attach'):
+            if self.attach_limit is None:
+                self.attach(self.attach_budget)
+            else:
+                self.attach(None, self.attach_limit)
+
+    def prefetch(self):
+        x, y = self.character_cell
+        directions = []
+        if self.camera.x > WIDTH // 2 - self.prefetch_margin[0]:
+            directions.append((1, 0))
+        elif self.camera.x < -WIDTH // 2 + self.prefetch_margin[0]:
+            directions.append((-1, 0))
+        if self.camera.y > HEIGHT // 2 - self.prefetch_margin[1]:
+            directions.append((0, -1))
+        elif self.camera.y < -HEIGHT // 2 + self.prefetch_margin[1]:
+            directions.append((0, 1))
+
+        for direction_x, direction_y in directions:
+            for side in (-1, 0, 1):
+                key = (x + 2 * direction_x + side * abs(direction_y), y + 2 * direction_y + side * abs(direction_x))
+                if key not in self.cells and key not in self.records:
+                    self.prefetcher.request(key)
+
     def new_cell(self):
-        try:
-            if self.character_cell[0] < 1 or self.character_cell[1] < 1:
-                raise IndexError
-            for _object in all_gameObjects:
-                if 'Indestructible' in _object.tags:
-                    continue
+        with profiler.scope('world.new_cell'):
+            self.max_distance = max(self.max_distance, abs(self.character_cell[0]), abs(self.character_cell[1]))
+            cells_for_create_pattern = [[-1, 0], [-1, -1], [-1, 1], [1, 0], [1, -1],
+                                        [1, 1], [0, 0], [0, -1], [0, 1]]
+            live = [(self.character_cell[0] + index[0], self.character_cell[1] + index[1])
+                    for index in cells_for_create_pattern]
+
+            for key in [key for key in self.loaded if key not in live]:
+                self.unload_cell(key)
 
+            for _object in all_gameObjects:
+                if _object.slot is None and not _object.tags.mask & TAG_INDESTRUCTIBLE:
+                    _object._kill()
+
+            for key in live:
+                if key not in self.loaded:
+                    self.load_cell(key)
+                self.cells.move_to_end(key)
+
+            while len(self.cells) > self.max_rooms:
+                key, cell = self.cells.popitem(last=False)
+                self.records[key] = cell.encode()
+
+    def cell(self, key):
+        if key in self.cells:
+            return self.cells[key]
+        if key in self.records:
+            with tracer.span('decode_cell', room=key):
+                cell = self.cells[key] = Cell.decode(self.records.pop(key), self.patterns)
+            return cell
+
+        cell = None if self.prefetcher is None else self.prefetcher.take(key)
+        if cell is None:
+            cell = self.generate_cell(key)
+        self.cells[key] = cell
+        return cell
+
+    def generate_cell(self, key):
+        with tracer.span('generate_cell', room=key):
+            _random = random.Random(f'{self.seed}:{key[0]}:{key[1]}')
+            pattern_id = _random.randrange(len(self.patterns))
+            cell = Cell((j.copy() for j in self.patterns[pattern_id]), pattern_id)
+            for j in cell:
+                j[1] = 1 if _random.random() < j[1] else 0
+            return cell
+
+    def load_cell(self, key):
+        cell = self.cell(key)
+        self.loaded[key] = []
+        # Паттерны снимаются с конца списка, поэтому он развернут
+        self.pending[key] = [(index, j[0]) for index, j in enumerate(cell) if j[1] == 1][::-1]
+
+        if self.static_layer is not None:
+            self.static_layer.load(key, cell, *self.camera.room_position(0, 0, key[0] - self.character_cell[0],
+                                                                         key[1] - self.character_cell[1]))
+
+    def attach(self, budget, limit=None):
+        start = perf_counter()
+        attached = 0
+        while self.pending:
+            key, patterns = next(iter(self.pending.items()))
+            delta_x, delta_y = key[0] - self.character_cell[0], key[1] - self.character_cell[1]
+            while patterns:
+                index, pattern = patterns.pop()
+                _object = pattern.init(delta_x, delta_y)
+                _object.slot = (key, index)
+                self.loaded[key].append(_object)
+                attached += 1
+                if budget is not None and perf_counter() - start > budget or \
+                        limit is not None and attached >= limit:
+                    return
+            del self.pending[key]
+
+    def unload_cell(self, key):
+        self.pending.pop(key, None)
+        for _object in self.loaded.pop(key):
+            if _object.alive():
                 _object._kill()
+        if self.static_layer is not None:
+            self.static_layer.unload(key)
 
-            cells_for_create_pattern = [[-1, 0], [-1, -1], [-1, 1], [1, 0], [1, -1],
-                                        [1, 1], [0, 0], [0, -1], [0, 1]]
+    # Записи клетки не удаляются, а только выключаются, поэтому номер паттерна в клетке не меняется,
+    #  а клетка объекта, который еще жив, всегда загружена (и находится в cells)
+    def forget(self, slot):
+        key, index = slot
+        self.cells[key][index][1] = 0
 
-            for index in cells_for_create_pattern:
-                if not self.cells[self.character_cell[0] + index[0]][self.character_cell[1] + index[1]]:
-                    pattern = random.choice(self.patterns)
-                    for j in pattern:
-                        self.cells[self.character_cell[0] + index[0]][self.character_cell[1] + index[1]] \
-                            .append(j.copy())
-
-                for j in range(len(self.cells[self.character_cell[0] + index[0]][self.character_cell[1] + index[1]])):
-                    if random.random() < self.cells[self.character_cell[0] + index[0]][
-                            self.character_cell[1] + index[1]][j][1]:
-                        self.cells[self.character_cell[0] + index[0]][
-                            self.character_cell[1] + index[1]][j][0].init(index[0], index[1])
-                        self.cells[self.character_cell[0] + index[0]][self.character_cell[1] + index[1]][j][1] = 1
-                    else:
-                        self.cells[self.character_cell[0] + index[0]][self.character_cell[1] + index[1]][j][1] = 0
-
-        except IndexError:
-            for index in range(len(self.cells)):
-                self.cells[index].insert(0, [])
-                self.cells[index].append([])
-
-            self.cells.insert(0, [[]] * len(self.cells[0]))
-            self.cells.append([[]] * len(self.cells[0]))
+    def stats(self):
+        return {'loaded': len(self.loaded), 'pending': sum(len(patterns) for patterns in self.pending.values()),
+                'cells': len(self.cells), 'records': len(self.records),
+                'record_bytes': sum(len(record) for record in self.records.values())}
 
-            self.character_cell[0] += 1
-            self.character_cell[1] += 1
 
-            self.new_cell()
+class Tags(list):
+    """
+    Список тегов, который вместе со строками хранит битовую маску этих тегов,
+     поэтому проверка наличия тегов сводится к одной битовой операции
+    Каждому названию тега при первом использовании выдается свой бит (registry)
+    Attributes:
+        mask: int
+            Битовая маска всех тегов списка, пересчитывается при любом изменении списка
+    Methods:
+        bit(name)
+            Возвращает бит тега name, при необходимости регистрирует новый тег
+        mask_of(tags)
+            Возвращает маску списка тегов, если передано число, возвращает его без изменений
+        from_mask(mask)
+            Возвращает список тегов, составляющих маску mask
+        has(mask)
+            Возвращает True, если список содержит все теги маски mask
+    """
+    registry = {}
+    masks = {}
 
-    def read_arg(self, arg, pattern, n):
-        if arg == 'None':
-            return None
+    def __init__(self, tags=()):
+        list.__init__(self, tags)
+        self._changed()
 
-        if pattern[n + 1] is float:
-            for constant in self.constants:
-                arg = arg.replace(constant, str(self.constants[constant]))
-            return eval(arg)
+    @staticmethod
+    def bit(name):
+        if name not in Tags.registry:
+            Tags.registry[name] = 1 << len(Tags.registry)
+        return Tags.registry[name]
 
-        if pattern[n + 1] is str:
-            return arg
+    @staticmethod
+    def from_mask(mask):
+        return Tags(name for name, bit in Tags.registry.items() if mask & bit)
 
-        if type(pattern[n + 1]) == list:
-            arg = arg.split(',')
-            for i in range(len(arg)):
-                if arg[i] == 'None':
-                    arg[i] = None
+    @staticmethod
+    def mask_of(tags):
+        if tags is None:
+            return 0
+        if isinstance(tags, int):
+            return tags
+        if isinstance(tags, Tags):
+            return tags.mask
+        key = tuple(tags)
+        if key not in Tags.masks:
+            mask = 0
+            for tag in key:
+                if tag is not None:
+                    mask |= Tags.bit(tag)
+            Tags.masks[key] = mask
+        return Tags.masks[key]
+
+    def has(self, mask):
+        return self.mask & mask == mask
+
+    def _changed(self):
+        self.mask = 0
+        for tag in self:
+            if tag is not None:
+                self.mask |= Tags.bit(tag)
+
+    def append(self, tag):
+        list.append(self, tag)
+        self._changed()
+
+    def extend(self, tags):
+        list.extend(self, tags)
+        self._changed()
+
+    def insert(self, index, tag):
+        list.insert(self, index, tag)
+        self._changed()
+
+    def remove(self, tag):
+        list.remove(self, tag)
+        self._changed()
+
+    def pop(self, index=-1):
+        tag = list.pop(self, index)
+        self._changed()
+        return tag
+
+    def clear(self):
+        list.clear(self)
+        self._changed()
+
+    def __setitem__(self, index, tag):
+        list.__setitem__(self, index, tag)
+        self._changed()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._changed()
+
+    def __iadd__(self, tags):
+        list.extend(self, tags)
+        self._changed()
+        return self
+
+
+TAG_WALL = Tags.bit('Wall')
+TAG_DANGEROUS = Tags.bit('Dangerous')
+TAG_DANGEROUS_FOR_ENEMY = Tags.bit('Dangerous for enemy')
+TAG_ONE_HIT = Tags.bit('One hit')
+TAG_INDESTRUCTIBLE = Tags.bit('Indestructible')
+TAG_AID_KID = Tags.bit('AidKid')
+TAG_COIN = Tags.bit('Coin')
+TAG_ITEM_SPAWNER = Tags.bit('Item spawner')
+TAG_BULLET = Tags.bit('Bullet')
+
+
+class Timer:
+    """
+    Таймер GameClock
+    Attributes:
+        deadline: float
+            Время срабатывания (по часам GameClock)
+        tick: int
+            Номер шага колеса, на котором таймер сработает
+        callback: function
+            Функция, вызываемая при срабатывании
+        args: tuple
+            Аргументы callback
+        cancelled: bool
+            Показывает, отменен ли таймер
+    """
 
-                elif pattern[n + 1][i % len(pattern[n + 1])] is int:
-                    for constant in self.constants:
-                        arg[i] = arg[i].replace(constant, str(self.constants[constant]))
-                    arg[i] = eval(arg[i])
+    def __init__(self, deadline, tick, callback, args):
+        self.deadline, self.tick = deadline, tick
+        self.callback, self.args = callback, args
+        self.cancelled = False
 
-                elif pattern[n + 1][0] is str:
-                    pass
 
-            return arg
+class GameClock:
+    """
+    Игровые часы, идущие только вперед на время кадра (clock.tick() в главном цикле),
+     и колесо таймеров (timer wheel), с помощью которого объекты узнают об истечении своего времени,
+     не опрашивая часы каждый кадр
+    Attributes:
+        now: float
+            Игровое время в секундах с начала игры
+        paused: bool
+            Если True, часы стоят и таймеры не срабатывают
+        resolution: float
+            Длина одного шага колеса в секундах
+        wheel: list
+            Колесо - список ячеек, таймер со сроком на шаге tick лежит в ячейке tick % len(wheel)
+        current_tick: int
+            Номер последнего обработанного шага колеса
+    Methods:
+        advance(delta)
+            Переводит часы на delta секунд вперед, вызывает callback всех истекших таймеров,
+             возвращает время, на которое часы фактически ушли вперед (0, если часы на паузе)
+        schedule(delay, callback, *args)
+            Регистрирует таймер, который через delay секунд вызовет callback(*args), возвращает Timer
+        cancel(timer)
+            Отменяет таймер (None допустим)
+        wait(time, delay)
+            Возвращает True, если с момента time прошло не меньше delay секунд
+    """
 
-    def read_cell(self, cell):
-        cell = cell.split('|')
-        return [self.instruction_for_patterns[cell[1]][0](*list(
-            self.read_arg(arg.strip(), self.instruction_for_patterns[cell[1]], i)
-            for i, arg in enumerate(cell[2:]))), float(cell[0])]
+    def __init__(self, resolution=1 / 120, slots=256):
+        self.now = 0.0
+        self.paused = False
+        self.resolution = resolution
+        self.wheel = [[] for _ in range(slots)]
+        self.current_tick = 0
+
+    def schedule(self, delay, callback, *args):
+        deadline = self.now + delay
+        tick = max(math.ceil(deadline / self.resolution), self.current_tick + 1)
+        timer = Timer(deadline, tick, callback, args)
+        self.wheel[tick % len(self.wheel)].append(timer)
+        return timer
+
+    @staticmethod
+    def cancel(timer):
+        if timer is not None:
+            timer.cancelled = True
+
+    def wait(self, time, delay):
+        return self.now - time >= delay
+
+    def advance(self, delta):
+        if self.paused:
+            return 0
+        self.now += delta
+        target_tick = int(self.now / self.resolution)
+        if target_tick <= self.current_tick:
+            return delta
+
+        if target_tick - self.current_tick >= len(self.wheel):
+            slots = range(len(self.wheel))
+        else:
+            slots = [tick % len(self.wheel) for tick in range(self.current_tick + 1, target_tick + 1)]
+        self.current_tick = target_tick
+
+        expired = []
+        for index in slots:
+            slot = self.wheel[index]
+            if not slot:
+                continue
+            waiting = []
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.tick <= target_tick:
+                    expired.append(timer)
+                else:
+                    waiting.append(timer)
+            self.wheel[index] = waiting
+
+        expired.sort(key=lambda timer: timer.deadline)
+        for timer in expired:
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+        return delta
 
 
 class EventController:
-    def __init__(self):
-        self.events = []
+    """
+    Шина событий: события лежат в кольцевом буфере фиксированного размера,
+     а получатели читают их через подписки, у каждой из которых свой курсор
+    Attributes:
+        capacity: int
+            Размер кольцевого буфера, при переполнении самые старые события вытесняются
+        lifetime: int
+            Сколько вызовов apply (шагов симуляции) живет событие
+        buffer: list
+            Кольцевой буфер событий, событие с номером seq лежит в buffer[seq % capacity]
+        head, tail: int
+            Номер самого старого живого события и номер, который получит следующее событие
+        index: dict
+            Маска тегов подписки -> отсортированный список номеров подходящих событий
+        boundaries: deque
+            Значения tail на последних lifetime вызовах apply, по ним события удаляются пачками
+        dropped: int
+            Сколько событий вытеснено из буфера до истечения их времени жизни
+    Methods:
+        add_event(event)
+            Кладет событие в буфер и в индексы подходящих подписок
+        subscribe(needed_tags)
+            Возвращает Subscription на события, у которых есть все теги needed_tags
+        apply()
+            Завершает шаг: удаляет пачкой события, прожившие lifetime шагов
+        stats()
+            Возвращает словарь с числом живых событий, вытесненных событий и индексов
+    """
+
+    def __init__(self, capacity=1024, lifetime=5):
+        self.capacity, self.lifetime = capacity, lifetime
+        self.buffer = [None] * capacity
+        self.head = self.tail = 0
+        self.index = {}
+        self.boundaries = deque(maxlen=lifetime)
+        self.dropped = 0
 
     def add_event(self, event):
-        self.events.append(event)
+        if self.tail - self.head >= self.capacity:
+            self._expire(self.head + 1)
+            self.dropped += 1
+        event.seq = self.tail
+        self.buffer[self.tail % self.capacity] = event
+        self.tail += 1
+        for mask, seqs in self.index.items():
+            if event.mask & mask == mask:
+                seqs.append(event.seq)
+
+    def subscribe(self, needed_tags):
+        mask = Tags.mask_of(needed_tags)
+        if mask not in self.index:
+            self.index[mask] = [seq for seq in range(self.head, self.tail)
+                                if self.buffer[seq % self.capacity].mask & mask == mask]
+        return Subscription(self, mask)
+
+    def events_since(self, mask, cursor):
+        seqs = self.index[mask]
+        start = bisect_left(seqs, max(cursor, self.head))
+        return [self.buffer[seq % self.capacity] for seq in seqs[start:]]
 
     def apply(self):
-        events_to_delete = []
-        for _event in self.events:
-            _event.apply()
-            if _event.time >= _event.max_time:
-                events_to_delete.append(_event)
-
-        for _event in events_to_delete:
-            self.events.remove(_event)
+        if len(self.boundaries) == self.lifetime:
+            self._expire(self.boundaries[0])
+        self.boundaries.append(self.tail)
+
+    def _expire(self, seq):
+        if seq <= self.head:
+            return
+        for old in range(self.head, seq):
+            self.buffer[old % self.capacity] = None
+        self.head = seq
+        for mask, seqs in self.index.items():
+            if seqs and seqs[0] < seq:
+                del seqs[:bisect_left(seqs, seq)]
+
+    def stats(self):
+        return {'events': self.tail - self.head, 'total': self.tail, 'dropped': self.dropped,
+                'subscriptions': len(self.index)}
+
+
+class Subscription:
+    """
+    Subscription - курсор получателя по событиям с заданными тегами,
+     каждое событие отдается подписке один раз
+    Attributes:
+        controller: EventController
+            Шина, из которой читаются события
+        mask: int
+            Битовая маска нужных тегов
+        cursor: int
+            Номер первого еще не прочитанного события
+    Methods:
+        poll()
+            Возвращает список новых событий с момента прошлого вызова (или подписки)
+    """
 
-    def get_events(self, needed_tags, _object):
-        events_to_return = []
-        for _event in self.events:
-            if all(map(lambda x: x in _event.args['tags'] and _object not in _event.calls, needed_tags)):
-                events_to_return.append(_event)
-                _event.set_call(_object)
+    def __init__(self, controller, mask):
+        self.controller, self.mask = controller, mask
+        self.cursor = controller.tail
 
-        return events_to_return
+    def poll(self):
+        if self.cursor == self.controller.tail:
+            return []
+        events = self.controller.events_since(self.mask, self.cursor)
+        self.cursor = self.controller.tail
+        return events
 
 
 class Event:
     """
-    Event - событие, сохраняемое в  массив EVENTS,
+    Event - событие, сохраняемое в EventController,
      с помощью которого можно выявить некое действие, происходящее в ходе игры
      Attributes:
          args: dict
             Словарь всех свойств данного события
+         mask: int
+            Битовая маска тегов события (args['tags'])
+         seq: int
+            Порядковый номер события в EventController
     Methods: None
     """
 
     def __init__(self, **args):
         self.args = args
-        self.calls = {}
-        self.new_calls = {}
-        self.time, self.max_time = 0, 5
-
-    def set_call(self, _object):
-        if _object not in self.new_calls:
-            self.new_calls[_object] = 0
-        self.new_calls[_object] += 1
-
-    def apply(self):
-        for call in self.new_calls:
-            if call not in self.calls:
-                self.calls[call] = 0
-            self.calls[call] += 1
-
-        self.new_calls = {}
-        self.time += 1
+        self.mask = Tags.mask_of(args.get('tags'))
+        self.seq = None
 
 
 class GameObject:
@@ -254,38 +1916,186 @@ class GameObject:
             высота объекта
         collision: Collision
             Коллайдер объекта
-        tags: list
-            Список свойств объекта
+        tags: Tags
+            Список свойств объекта, при присваивании обычного списка он превращается в Tags
         id: int
             Уникальный номер объекта
-        time: datetime.datetime
-            Время создания обьекта
-    Methods: None
+        time: float
+            Время создания обьекта (по game_clock)
+        _layer: int
+            Слой, в котором объект рисует CameraGroup
+        slot: tuple или None
+            Паттерн, создавший объект, - (номер клетки, номер паттерна в клетке),
+             None - объект создан не WorldGenerator
+        previous_position: tuple или None
+            Положение на начало шага симуляции, если не None, CameraGroup рисует объект
+             между previous_position и (x, y) (только для объектов из FixedTimestep.tracked)
+        rect_position: tuple
+            (x, y), под которые последний раз подгонялся rect
+    Methods:
+        revive(x, y)
+            Возвращает в игру объект, взятый из ObjectPool
+        save_position()
+            Запоминает положение объекта в начале шага симуляции
+        sync_rect()
+            Сдвигает rect на (x, y), если объект сдвинулся, не создавая нового прямоугольника
     """
     COLOR = [252, 247, 190]
     FON_COLOR = [24, 28, 25]
+    _layer = LAYER_ACTORS
+    slot = None
+    previous_position = None
 
     def __init__(self, x=0, y=0, width=0, height=0):
         global number_of_gameobjects
         self.x, self.y = x, y
         self.width, self.height = width, height
         self.rect = pygame.Rect(self.x, self.y, width, height)
+        self.rect_position = (self.x, self.y)
         self.collision = Collision(0, 0, width, height, self)
         self.tags = []
         self.id = number_of_gameobjects
         number_of_gameobjects += 1
-        self.time = datetime.datetime.now()
+        self.time = game_clock.now
+
+    @property
+    def tags(self):
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        self._tags = tags if isinstance(tags, Tags) else Tags(tags)
 
     def wait(self, time, delay):
-        if datetime.datetime.now() - time >= datetime.timedelta(seconds=delay):
-            return True
+        return game_clock.wait(time, delay)
 
     def translate(self, delta_x, delta_y):
         self.x += delta_x
         self.y += delta_y
 
+    def save_position(self):
+        self.previous_position = (self.x, self.y)
+
+    def revive(self, x, y):
+        """Возвращает в игру объект, взятый из ObjectPool, на позицию (x, y)"""
+        self.x, self.y = x, y
+        self.sync_rect()
+        self.time = game_clock.now
+        all_gameObjects.add(self)
+        all_collisions.add(self.collision)
+        self.collision.update()
+
+    def sync_rect(self):
+        position = (self.x, self.y)
+        if position != self.rect_position:
+            self.rect_position = position
+            self.rect.update(self.x, self.y, self.width, self.height)
+
     def update(self):
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+        self.sync_rect()
+
+
+class SpatialHash:
+    """
+    Равномерная сетка (spatial hash) в мировых координатах, по ячейкам которой раскладываются все коллизии,
+     позволяет искать пересечения только среди соседних коллизий, а не среди всех
+    Attributes:
+        cell_size: int
+            Длина стороны одной ячейки сетки
+        cells: dict
+            Словарь, ключ - номер ячейки (по оси абсцисс, по оси ординат), значение - множество коллизий
+        stamp: int
+            Номер последнего запроса, нужен, чтобы не возвращать одну коллизию дважды
+    Methods:
+        insert(collision)
+            Добавляет коллизию в ячейки, которые она занимает
+        remove(collision)
+            Убирает коллизию из всех ячеек
+        move(collision)
+            Перекладывает коллизию, если после перемещения она занимает другие ячейки
+        query(x, y, width, height, object_mask, collision_mask, exclude)
+            Возвращает список коллизий, пересекающихся с прямоугольником,
+             у объекта которых есть все теги object_mask, а у самих коллизий - все теги collision_mask
+        objects(x, y, width, height)
+            Возвращает множество объектов, коллизии которых лежат в ячейках, задевающих прямоугольник
+    """
+
+    def __init__(self, cell_size=128):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.stamp = 0
+        self._rect = pygame.Rect(0, 0, 0, 0)
+
+    def insert(self, collision):
+        rect = collision.rect
+        left = rect.x // self.cell_size
+        top = rect.y // self.cell_size
+        right = (rect.x + rect.width) // self.cell_size
+        bottom = (rect.y + rect.height) // self.cell_size
+        for i in range(left, right + 1):
+            for j in range(top, bottom + 1):
+                cell = self.cells.get((i, j))
+                if cell is None:
+                    cell = self.cells[(i, j)] = set()
+                cell.add(collision)
+        collision.hash_bounds = (left, top, right, bottom)
+
+    def remove(self, collision):
+        if collision.hash_bounds is None:
+            return
+        left, top, right, bottom = collision.hash_bounds
+        for i in range(left, right + 1):
+            for j in range(top, bottom + 1):
+                cell = self.cells.get((i, j))
+                if cell is not None:
+                    cell.discard(collision)
+                    if not cell:
+                        del self.cells[(i, j)]
+        collision.hash_bounds = None
+
+    def move(self, collision):
+        rect = collision.rect
+        bounds = collision.hash_bounds
+        if bounds is not None and \
+                bounds[0] == rect.x // self.cell_size and \
+                bounds[1] == rect.y // self.cell_size and \
+                bounds[2] == (rect.x + rect.width) // self.cell_size and \
+                bounds[3] == (rect.y + rect.height) // self.cell_size:
+            return
+        self.remove(collision)
+        self.insert(collision)
+
+    def query(self, x, y, width, height, object_mask=0, collision_mask=0, exclude=None):
+        self.stamp += 1
+        stamp = self.stamp
+        rect = self._rect
+        rect.update(x, y, width, height)
+        contacts = []
+        for i in range(int(x // self.cell_size), int((x + width) // self.cell_size) + 1):
+            for j in range(int(y // self.cell_size), int((y + height) // self.cell_size) + 1):
+                cell = self.cells.get((i, j))
+                if cell is None:
+                    continue
+                for collision in cell:
+                    if collision.query_stamp == stamp:
+                        continue
+                    collision.query_stamp = stamp
+                    if collision is exclude or not rect.colliderect(collision.rect):
+                        continue
+                    if collision.gameObject.tags.mask & object_mask == object_mask and \
+                            collision.tags.mask & collision_mask == collision_mask:
+                        contacts.append(collision)
+
+        return contacts
+
+    def objects(self, x, y, width, height):
+        found = set()
+        for i in range(int(x // self.cell_size), int((x + width) // self.cell_size) + 1):
+            for j in range(int(y // self.cell_size), int((y + height) // self.cell_size) + 1):
+                cell = self.cells.get((i, j))
+                if cell is not None:
+                    found.update(collision.gameObject for collision in cell)
+        return found
 
 
 class Collision(pygame.sprite.Sprite):
@@ -306,24 +2116,104 @@ class Collision(pygame.sprite.Sprite):
         self.tags = []
 
         self.rect = pygame.Rect(self.gameObject.x + self.x, self.gameObject.y + self.y, self.width, self.height)
+        self.position = (self.gameObject.x, self.gameObject.y)
+        self.hash_bounds = None
+        self.query_stamp = 0
+        spatial_hash.insert(self)
 
+    # Двигает rect и ячейки spatial_hash, только если родительский объект сдвинулся
+    # или коллизия вернулась в игру (после kill она убрана из spatial_hash)
     def update(self):
-        self.rect = pygame.Rect(self.gameObject.x + self.x, self.gameObject.y + self.y, self.width, self.height)
+        position = (self.gameObject.x, self.gameObject.y)
+        if position != self.position:
+            self.position = position
+            self.rect.update(position[0] + self.x, position[1] + self.y, self.width, self.height)
+        elif self.hash_bounds is not None:
+            return
+        if self.alive():
+            spatial_hash.move(self)
+
+    def resize(self, width, height):
+        self.width, self.height = width, height
+        self.rect.size = (width, height)
+        if self.alive():
+            spatial_hash.move(self)
 
-    # Возвращает коллизии
+    @property
+    def tags(self):
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        self._tags = tags if isinstance(tags, Tags) else Tags(tags)
+
+    def kill(self):
+        spatial_hash.remove(self)
+        pygame.sprite.Sprite.kill(self)
+
+    # Возвращает коллизии (в том числе коллизии пуль из projectiles),
+    # теги можно передавать списком строк или битовой маской
     def can_move_collisions(self, delta_x=0, delta_y=0, needed_tags_of_object=None, needed_tags_of_collision=None):
-        if needed_tags_of_object is None:
-            needed_tags_of_object = []
-        if needed_tags_of_collision is None:
-            needed_tags_of_collision = []
-        ghost = Collision(self.x + delta_x, self.y + delta_y, self.width, self.height, self.gameObject)
-        all_contacts = list(filter(lambda x: set(needed_tags_of_object).issubset(set(x.gameObject.tags)) and set(
-            needed_tags_of_collision).issubset(set(x.tags)) and x is not self,
-                                   pygame.sprite.spritecollide(ghost, all_collisions, False,
-                                                               pygame.sprite.collide_rect)))
-        ghost.kill()
+        object_mask = Tags.mask_of(needed_tags_of_object)
+        collision_mask = Tags.mask_of(needed_tags_of_collision)
+        x, y = self.gameObject.x + self.x + delta_x, self.gameObject.y + self.y + delta_y
+        contacts = spatial_hash.query(x, y, self.width, self.height, object_mask, collision_mask, self)
+        contacts.extend(projectiles.query(int(x), int(y), self.width, self.height, object_mask, collision_mask))
+        return contacts
+
+
+class ObjectPool:
+    """
+    Пул короткоживущих объектов, уничтоженные объекты не выбрасываются, а переиспользуются,
+     поэтому не создаются заново спрайт, коллизия и поверхность
+    Attributes:
+        factory: type
+            Класс объектов пула, вызывается, когда свободных объектов нет
+        free: list
+            Уничтоженные объекты, которые можно переиспользовать
+        hits: int
+            Количество выдач уже существующего объекта
+        misses: int
+            Количество созданий нового объекта
+        in_use: int
+            Количество выданных и еще не возвращенных объектов
+        high_water: int
+            Наибольшее значение in_use
+    Methods:
+        acquire(*args)
+            Возвращает объект, у переиспользуемого объекта вызывается reset(*args),
+             новый объект создается как factory(*args)
+        release(_object)
+            Возвращает объект в пул
+        stats()
+            Возвращает словарь со счетчиками пула
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.free = []
+        self.hits = self.misses = 0
+        self.in_use = self.high_water = 0
+
+    def acquire(self, *args):
+        if self.free:
+            self.hits += 1
+            _object = self.free.pop()
+            _object.reset(*args)
+        else:
+            self.misses += 1
+            _object = self.factory(*args)
+        self.in_use += 1
+        self.high_water = max(self.high_water, self.in_use)
+        return _object
 
-        return all_contacts
+    def release(self, _object):
+        self.in_use -= 1
+        self.free.append(_object)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'in_use': self.in_use, 'high_water': self.high_water,
+                'free': len(self.free)}
 
 
 class Item:
@@ -364,19 +2254,20 @@ class ItemSpawner(pygame.sprite.Sprite, GameObject):
             Список всех возможных объектов
         item: Item
             Случайно выбранный предмет из items
-        time: datetime.datetime
-            Время последней передачи предмета
         time_between_receiving_items: float
             Время через которое можно передавать предметы в секундах
         was_purchase: bool
             Показывает, был ли куплен предмет item
+        timer: Timer
+            Таймер, возвращающий коллизии нормальные размеры
     Methods:
         update(tick=0)
             Пишет над объектом предмет, хранящийся в данном объекте и цену предмета
-            Если с посленей передачи прдмета прошло болше времени чем time_between_receiving_items
-            дает коллизии нормальные размеры
-        wait(time, delay)
-            Возаврыщает True, если с time прошло больше времени, чем delay
+        hide_collision()
+            Убирает коллизию после передачи предмета, через time_between_receiving_items
+             game_clock вернет коллизии нормальные размеры (show_collision)
+        show_collision()
+            Дает коллизии нормальные размеры
     """
 
     def __init__(self, x, y):
@@ -392,32 +2283,28 @@ class ItemSpawner(pygame.sprite.Sprite, GameObject):
         self.time_between_receiving_items = 1
 
         self.was_purchase = False
+        self.timer = None
 
-        self.font = pygame.font.Font(None, 20)
+        self.item_inscription = all_inscriptions['Item ' + str(self.id)] = Inscription(20, in_world=True)
+        self.price_inscription = all_inscriptions['Price ' + str(self.id)] = Inscription(20, in_world=True)
 
     def update(self, tick=0):
-        all_inscriptions['Item ' + str(self.id)] = [self.font.render(f'Item: {self.item.name}',
-                                                                     True, GameObject.COLOR), self.x + self.width // 2 -
-                                                    self.font.size(f'Item: {self.item.name}')[0] // 2, self.y - 40,
-                                                    self.font.size(f'Item: {self.item.name}')[0],
-                                                    self.font.size(f'Item: {self.item.name}')[1]]
-        all_inscriptions['Price ' + str(self.id)] = [self.font.render(f'Price: {self.item.price}',
-                                                                      True, GameObject.COLOR),
-                                                     self.x + self.width // 2 -
-                                                     self.font.size(f'Price: {self.item.price}')[0] // 2, self.y - 20,
-                                                     self.font.size('Price ' + str(self.id))[0],
-                                                     self.font.size('Price ' + str(self.id))[1]
-                                                     ]
-        if self.wait(self.time, self.time_between_receiving_items):
-            self.collision.width, self.collision.height = self.width, self.height
-        self.collision.update()
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+        self.item_inscription.set_text(f'Item: {self.item.name}')
+        self.item_inscription.move(self.x + self.width // 2 - self.item_inscription.width // 2, self.y - 40)
+        self.price_inscription.set_text(f'Price: {self.item.price}')
+        self.price_inscription.move(self.x + self.width // 2 - self.price_inscription.width // 2, self.y - 20)
 
-    def wait(self, time, delay):
-        if datetime.datetime.now() - time >= datetime.timedelta(seconds=delay):
-            return True
+    def hide_collision(self):
+        self.collision.resize(0, 0)
+        game_clock.cancel(self.timer)
+        self.timer = game_clock.schedule(self.time_between_receiving_items, self.show_collision)
+
+    def show_collision(self):
+        self.collision.resize(self.width, self.height)
+        self.timer = None
 
     def _kill(self):
+        game_clock.cancel(self.timer)
         self.collision.kill()
         self.kill()
 
@@ -436,15 +2323,14 @@ class PatternItemSpawner:
             Высота объекта
     Methods:
         init(delta_x, delta_y)
-            Создает объект Enemy1
+            Создает объект Enemy1 и возвращает его
     """
 
     def __init__(self, x, y):
         self.x, self.y = x, y
 
     def init(self, delta_x, delta_y):
-        ItemSpawner(self.x + (CAMERA_WIDTH - WIDTH) // 2 - camera.x + WIDTH * delta_x,
-                    self.y + (CAMERA_HEIGHT - HEIGHT) // 2 - camera.y - HEIGHT * delta_y)
+        return ItemSpawner(*camera.room_position(self.x, self.y, delta_x, delta_y))
 
 
 class Enemy1(pygame.sprite.Sprite, GameObject):
@@ -460,21 +2346,23 @@ class Enemy1(pygame.sprite.Sprite, GameObject):
             Скорость пуль
         distance_of_attack: float
             Дистанция, с которой враг начнет атаковать игрока
-        time: datetime.datetime
+        time: float
             Время, когда последний раз объект получил урон
         time_between_enemy_attack: float
             Время с последнего урона по объекту, в течение которого объект нельзя обижать
-        time_attack: datetime.datetime
-            Время последней атаки объекта
         time_between_attack_on_character: float
             Время между атаками объекта
+        turret: int
+            Номер объекта в turrets (TurretController), который стреляет за объект пулей Bullet в сторону игрока,
+             если игрок в поле действия и прошло необходимое время
     Methods:
         update(tick=0)
             Пишет над объектом оставшиеся здоровье
             Если объект соприкоснулся с объектом со свойством "Dangerous for enemy" и can_be_under_attack == True,
             по объекту наносится урон
-            Если игрок в поле действия и прошло необходимое время, стреляет пулей Bullet в сторону игрока
             Если здоровье меньшу 1, уничтожает объект
+        update_inscription()
+            Обновляет надпись со здоровьем над объектом
         distance(target)
             Возвращает расстояние до target
         distance_x(target)
@@ -497,46 +2385,34 @@ class Enemy1(pygame.sprite.Sprite, GameObject):
         self.velocity_of_bullet = 800
         self.distance_of_attack = 500
         self.can_be_under_attack = True
-        self.time, self.time_between_enemy_attack = datetime.datetime.now(), 0.1
-        self.time_attack = datetime.datetime.now()
+        self.time, self.time_between_enemy_attack = game_clock.now, 0.1
         self.time_between_attack_on_character = 0.2
 
-        self.font = pygame.font.Font(None, 30)
-        text = self.font.render(str(self.hp), True, [252, 247, 190])
-        all_inscriptions[f'Enemy {self.id}'] = [text, self.x + (
-                self.width - self.font.size(str(self.hp))[0]) // 2, self.y - self.font.size(str(self.hp))[1],
-                                                self.font.size(str(self.hp))[0], self.font.size(str(self.hp))[1]]
+        self.inscription = all_inscriptions[f'Enemy {self.id}'] = Inscription(30, in_world=True)
+        self.update_inscription()
+        self.turret = turrets.add(self, self.distance_of_attack, self.time_between_attack_on_character,
+                                  self.velocity_of_bullet, ProjectileSystem.BULLET, 10, 10)
 
     def update(self, tick=0):
-        for dangerous_object in self.collision.can_move_collisions(0, 0, ['Dangerous for enemy']):
+        for dangerous_object in self.collision.can_move_collisions(0, 0, TAG_DANGEROUS_FOR_ENEMY):
             if self.wait(self.time, self.time_between_enemy_attack):
                 self.hp -= dangerous_object.gameObject.damage
-                self.time = datetime.datetime.now()
+                self.time = game_clock.now
                 self.can_be_under_attack = False
 
-            if 'One hit' in dangerous_object.gameObject.tags:
+            if dangerous_object.gameObject.tags.mask & TAG_ONE_HIT:
                 dangerous_object.gameObject._kill()
 
-        text = self.font.render(str(self.hp), True, [252, 247, 190])
-        all_inscriptions[f'Enemy {self.id}'] = [text, self.x + (
-                self.width - self.font.size(str(self.hp))[0]) // 2, self.y - self.font.size(str(self.hp))[1],
-                                                self.font.size(str(self.hp))[0], self.font.size(str(self.hp))[1]]
-
-        if self.distance(character) < self.distance_of_attack and self.wait(self.time_attack,
-                                                                            self.time_between_attack_on_character):
-            self.time_attack = datetime.datetime.now()
-            c = (self.distance_x(character) * self.velocity_of_bullet / self.distance(character),
-                 self.distance_y(character) * self.velocity_of_bullet / self.distance(character))
-
-            Bullet(self.x + self.width // 2 - 5, self.y + self.height // 2 - 5, 10, 10,
-                   c[0], c[1], 10, ['Dangerous', 'Indestructible', 'One hit'], ['Dangerous'])
-
-        self.collision.update()
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+        self.update_inscription()
 
         if self.hp <= 0:
             self._kill(True)
 
+    def update_inscription(self):
+        self.inscription.set_text(str(self.hp))
+        self.inscription.move(self.x + (self.width - self.inscription.width) // 2,
+                              self.y - self.inscription.height)
+
     def distance(self, target):
         return math.sqrt(self.distance_x(target) ** 2 + self.distance_y(target) ** 2)
 
@@ -550,17 +2426,11 @@ class Enemy1(pygame.sprite.Sprite, GameObject):
         if forever:
             global KILLS
             KILLS += 1
-            Coin(self.x + self.width // 2 - 5, self.y + self.height // 2 - 5)
-            for index in range(len(world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                                       world_generator.character_cell[1] + self.y_of_cell])):
-                if type(world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                            world_generator.character_cell[1] + self.y_of_cell][index][0]) == PatternEnemy1 and \
-                        world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                            world_generator.character_cell[1] + self.y_of_cell][index][1] == 1:
-                    world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                        world_generator.character_cell[1] + self.y_of_cell].pop(index)
-                    break
+            Coin.pool.acquire(self.x + self.width // 2 - 5, self.y + self.height // 2 - 5)
+            if self.slot is not None:
+                world_generator.forget(self.slot)
         all_inscriptions.pop(f'Enemy {self.id}')
+        turrets.remove(self.turret)
         self.collision.kill()
         self.kill()
 
@@ -579,7 +2449,7 @@ class PatternEnemy1:
             Высота объекта
     Methods:
         init(delta_x, delta_y)
-            Создает объект Enemy1
+            Создает и возвращает объект Enemy1
     """
 
     def __init__(self, x, y):
@@ -587,10 +2457,7 @@ class PatternEnemy1:
         self.width, self.height = 50, 50
 
     def init(self, delta_x, delta_y):
-        enemy = Enemy1(self.x + (CAMERA_WIDTH - WIDTH) // 2 - camera.x + WIDTH * delta_x,
-                       self.y + (CAMERA_HEIGHT - HEIGHT) // 2 - camera.y - HEIGHT * delta_y, self.width, self.height)
-        enemy.x_of_cell = delta_x
-        enemy.y_of_cell = delta_y
+        return Enemy1(*camera.room_position(self.x, self.y, delta_x, delta_y), self.width, self.height)
 
 
 class Enemy2(pygame.sprite.Sprite, GameObject):
@@ -606,21 +2473,23 @@ class Enemy2(pygame.sprite.Sprite, GameObject):
                 Скорость пуль
             distance_of_attack: float
                 Дистанция, с которой враг начнет атаковать игрока
-            time: datetime.datetime
+            time: float
                 Время, когда последний раз объект получил урон
             time_between_enemy_attack: float
                 Время с последнего урона по объекту, в течение которого объект нельзя обижать
-            time_attack: datetime.datetime
-                Время последней атаки объекта
             time_between_attack_on_character: float
                 Время между атаками объекта
+            turret: int
+                Номер объекта в turrets (TurretController), который стреляет за объект пулей SuperBullet
+                 в сторону игрока, если игрок в поле действия и прошло необходимое время
         Methods:
             update(tick=0)
                 Пишет над объектом оставшиеся здоровье
                 Если объект соприкоснулся с объектом со свойством "Dangerous for enemy" и can_be_under_attack == True,
                 по объекту наносится урон
-                Если игрок в поле действия и прошло необходимое время, стреляет пулей SuperBullet в сторону игрока
                 Если здоровье меньшу 1, уничтожает объект
+            update_inscription()
+                Обновляет надпись со здоровьем над объектом
             distance(target)
                 Возвращает расстояние до target
             distance_x(target)
@@ -643,45 +2512,35 @@ class Enemy2(pygame.sprite.Sprite, GameObject):
         self.velocity_of_bullet = 600
         self.distance_of_attack = 800
         self.delta_velocity = delta_velocity
-        self.time, self.time_between_enemy_attack = datetime.datetime.now(), 0.1
-        self.time_attack = datetime.datetime.now()
+        self.time, self.time_between_enemy_attack = game_clock.now, 0.1
+        self.time_between_attack_on_character = 1
 
-        self.font = pygame.font.Font(None, 30)
-        text = self.font.render(str(self.hp), True, [252, 247, 190])
-        all_inscriptions[f'Enemy {self.id}'] = [text, self.x + (
-                self.width - self.font.size(str(self.hp))[0]) // 2, self.y - self.font.size(str(self.hp))[1],
-                                                self.font.size(str(self.hp))[0], self.font.size(str(self.hp))[1]]
+        self.inscription = all_inscriptions[f'Enemy {self.id}'] = Inscription(30, in_world=True)
+        self.update_inscription()
+        self.turret = turrets.add(self, self.distance_of_attack, self.time_between_attack_on_character,
+                                  self.velocity_of_bullet, ProjectileSystem.SUPER_BULLET, 20, 20, self.delta_velocity)
 
     def update(self, tick=0):
         # print(self.collision.can_move_collisions())
-        for dangerous_object in self.collision.can_move_collisions(0, 0, ['Dangerous for enemy']):
+        for dangerous_object in self.collision.can_move_collisions(0, 0, TAG_DANGEROUS_FOR_ENEMY):
             if self.wait(self.time, self.time_between_enemy_attack):
                 self.hp -= dangerous_object.gameObject.damage
-                self.time = datetime.datetime.now()
+                self.time = game_clock.now
                 self.can_be_under_attack = False
 
-            if 'One hit' in dangerous_object.gameObject.tags:
+            if dangerous_object.gameObject.tags.mask & TAG_ONE_HIT:
                 dangerous_object.gameObject._kill()
 
-        text = self.font.render(str(self.hp), True, [252, 247, 190])
-        all_inscriptions[f'Enemy {self.id}'] = [text, self.x + (
-                self.width - self.font.size(str(self.hp))[0]) // 2, self.y - self.font.size(str(self.hp))[1],
-                                                self.font.size(str(self.hp))[0], self.font.size(str(self.hp))[1]]
-
-        if self.distance(character) < self.distance_of_attack and self.wait(self.time_attack, 1):
-            self.time_attack = datetime.datetime.now()
-            c = (self.distance_x(character) * self.velocity_of_bullet / self.distance(character),
-                 self.distance_y(character) * self.velocity_of_bullet / self.distance(character))
-
-            SuperBullet(character, self.x + self.width // 2 - 10, self.y + self.height // 2 - 10, 20, 20, c[0], c[1],
-                        self.delta_velocity, 20, ['Dangerous', 'Indestructible', 'One hit'], ['Dangerous'])
-
-        self.collision.update()
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+        self.update_inscription()
 
         if self.hp <= 0:
             self._kill(True)
 
+    def update_inscription(self):
+        self.inscription.set_text(str(self.hp))
+        self.inscription.move(self.x + (self.width - self.inscription.width) // 2,
+                              self.y - self.inscription.height)
+
     def distance(self, target):
         return math.sqrt(self.distance_x(target) ** 2 + self.distance_y(target) ** 2)
 
@@ -695,17 +2554,11 @@ class Enemy2(pygame.sprite.Sprite, GameObject):
         if forever:
             global KILLS
             KILLS += 1
-            Coin(self.x + self.width // 2 - 5, self.y + self.height // 2 - 5)
-            for index in range(len(world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                                       world_generator.character_cell[1] + self.y_of_cell])):
-                if type(world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                            world_generator.character_cell[1] + self.y_of_cell][index][0]) == PatternEnemy2 and \
-                        world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                            world_generator.character_cell[1] + self.y_of_cell][index][1] == 1:
-                    world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                        world_generator.character_cell[1] + self.y_of_cell].pop(index)
-                    break
+            Coin.pool.acquire(self.x + self.width // 2 - 5, self.y + self.height // 2 - 5)
+            if self.slot is not None:
+                world_generator.forget(self.slot)
         all_inscriptions.pop(f'Enemy {self.id}')
+        turrets.remove(self.turret)
         self.collision.kill()
         self.kill()
 
@@ -724,7 +2577,7 @@ class PatternEnemy2:
                 Высота объекта
         Methods:
             init(delta_x, delta_y)
-                Создает объект Enemy2
+                Создает и возвращает объект Enemy2
         """
 
     def __init__(self, x, y, delta_velocity):
@@ -733,11 +2586,150 @@ class PatternEnemy2:
         self.delta_velocity = delta_velocity
 
     def init(self, delta_x, delta_y):
-        enemy = Enemy2(self.x + (CAMERA_WIDTH - WIDTH) // 2 - camera.x + WIDTH * delta_x,
-                       self.y + (CAMERA_HEIGHT - HEIGHT) // 2 - camera.y - HEIGHT * delta_y, self.width, self.height,
-                       self.delta_velocity)
-        enemy.x_of_cell = delta_x
-        enemy.y_of_cell = delta_y
+        return Enemy2(*camera.room_position(self.x, self.y, delta_x, delta_y), self.width, self.height,
+                      self.delta_velocity)
+
+
+class TurretController:
+    """
+    Общий для всех врагов-турелей (Enemy1, Enemy2) расчет стрельбы: позиции, радиусы атаки, время перезарядки
+     и параметры пуль всех турелей хранятся в массивах numpy, поэтому расстояния до игрока, решение стрелять
+     и направления выстрелов считаются за один проход для всех турелей, а пули создаются пачкой
+    Attributes:
+        capacity: int
+            Размер массивов, при нехватке места увеличивается вдвое
+        count: int
+            Количество используемых ячеек массивов
+        free: list
+            Номера освободившихся ячеек
+        owners: list
+            Объекты турелей по номерам ячеек (None - ячейка свободна)
+        alive: np.ndarray
+            Показывает, занята ли ячейка
+        x, y: np.ndarray
+            Центры турелей
+        radius: np.ndarray
+            Дистанция, с которой турель начинает стрелять
+        cooldown: np.ndarray
+            Время между выстрелами
+        last_attack: np.ndarray
+            Время последнего выстрела (по game_clock)
+        velocity: np.ndarray
+            Скорость пуль
+        kind: np.ndarray
+            Вид пуль (ProjectileSystem.BULLET или ProjectileSystem.SUPER_BULLET)
+        size: np.ndarray
+            Размер стороны пули
+        damage: np.ndarray
+            Урон пули
+        delta_velocity: np.ndarray
+            Изменение траектории пули (для SUPER_BULLET)
+        shots: int
+            Количество выстрелов за последний вызов update
+    Methods:
+        add(owner, radius, cooldown, velocity, kind, size, damage, delta_velocity=0)
+            Регистрирует турель owner и возвращает ее номер
+        remove(index)
+            Убирает турель с номером index
+        update(target)
+            Стреляет из всех турелей, которые готовы к выстрелу и до target которых меньше их radius
+        stats()
+            Возвращает словарь со счетчиками
+    """
+    TAGS, TAGS_OF_COLLISION = Tags(['Dangerous', 'Indestructible', 'One hit']), Tags(['Dangerous'])
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.count = 0
+        self.free = []
+        self.owners = [None] * capacity
+        self.shots = 0
+
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.radius = np.zeros(capacity)
+        self.cooldown = np.zeros(capacity)
+        self.last_attack = np.zeros(capacity)
+        self.velocity = np.zeros(capacity)
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.size = np.zeros(capacity)
+        self.damage = np.zeros(capacity, dtype=np.int64)
+        self.delta_velocity = np.zeros(capacity)
+
+    def _grow(self):
+        for name in ('alive', 'x', 'y', 'radius', 'cooldown', 'last_attack', 'velocity', 'kind', 'size',
+                     'damage', 'delta_velocity'):
+            array = getattr(self, name)
+            new_array = np.zeros(self.capacity * 2, dtype=array.dtype)
+            new_array[:self.capacity] = array
+            setattr(self, name, new_array)
+        self.owners.extend([None] * self.capacity)
+        self.capacity *= 2
+
+    def add(self, owner, radius, cooldown, velocity, kind, size, damage, delta_velocity=0):
+        if self.free:
+            index = self.free.pop()
+        else:
+            if self.count == self.capacity:
+                self._grow()
+            index = self.count
+            self.count += 1
+
+        self.owners[index] = owner
+        self.alive[index] = True
+        self.x[index] = owner.x + owner.width // 2
+        self.y[index] = owner.y + owner.height // 2
+        self.radius[index], self.cooldown[index] = radius, cooldown
+        self.last_attack[index] = game_clock.now
+        self.velocity[index], self.kind[index] = velocity, kind
+        self.size[index], self.damage[index] = size, damage
+        self.delta_velocity[index] = delta_velocity
+        return index
+
+    def remove(self, index):
+        if not self.alive[index]:
+            return
+        self.alive[index] = False
+        self.owners[index] = None
+        self.free.append(index)
+        while self.count and not self.alive[self.count - 1]:
+            self.count -= 1
+        self.free = [index for index in self.free if index < self.count]
+
+    def update(self, target):
+        self.shots = 0
+        n = self.count
+        if not n:
+            return
+
+        distance_x = target.x + target.width // 2 - self.x[:n]
+        distance_y = target.y + target.height // 2 - self.y[:n]
+        distance = np.hypot(distance_x, distance_y)
+        ready = np.flatnonzero(self.alive[:n] & (distance < self.radius[:n]) &
+                               (game_clock.now - self.last_attack[:n] >= self.cooldown[:n]))
+        if not len(ready):
+            return
+
+        self.last_attack[ready] = game_clock.now
+        self.shots = len(ready)
+        distance = np.where(distance[ready] == 0, 1, distance[ready])
+        velocity_x = distance_x[ready] * self.velocity[ready] / distance
+        velocity_y = distance_y[ready] * self.velocity[ready] / distance
+        size = self.size[ready]
+        x, y = self.x[ready] - size // 2, self.y[ready] - size // 2
+
+        for kind in np.unique(self.kind[ready]).tolist():
+            shots = self.kind[ready] == kind
+            projectiles.spawn_batch(kind, x[shots], y[shots], size[shots], size[shots],
+                                    velocity_x[shots], velocity_y[shots], self.damage[ready][shots],
+                                    TurretController.TAGS, TurretController.TAGS_OF_COLLISION,
+                                    target=None if kind == ProjectileSystem.BULLET else target,
+                                    delta_velocity=self.delta_velocity[ready][shots],
+                                    time_of_live=1 if kind == ProjectileSystem.BULLET else 3)
+
+    def stats(self):
+        return {'turrets': int(self.alive[:self.count].sum()), 'capacity': self.capacity, 'shots': self.shots}
 
 
 class Gun:
@@ -748,7 +2740,7 @@ class Gun:
             Носитель оружия
         damage: float
             Урон, который будет наносить пуля
-        time: datetime.datetime
+        time: float
             Время последнего выстрела
         time_between_attack: float
             Время, которое должно пройти с предыдущего выстрела, чтобы сделать новый (в секундах)
@@ -761,7 +2753,7 @@ class Gun:
     def __init__(self, carrier):
         self.carrier = carrier
         self.damage = 30
-        self.time, self.time_between_attack = datetime.datetime.now(), 0.5
+        self.time, self.time_between_attack = game_clock.now, 0.5
 
     def hit(self, direction):
         if not self.wait(self.time, self.time_between_attack):
@@ -785,14 +2777,13 @@ class Gun:
         else:
             return None
 
-        Bullet(w, h, 10, 10, velocity_x, velocity_y, self.damage,
-               ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'], self)
+        projectiles.spawn_bullet(w, h, 10, 10, velocity_x, velocity_y, self.damage,
+                                 ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'], self)
 
-        self.time = datetime.datetime.now()
+        self.time = game_clock.now
 
     def wait(self, time, delay):
-        if datetime.datetime.now() - time >= datetime.timedelta(seconds=delay):
-            return True
+        return game_clock.wait(time, delay)
 
 
 class MachineGun(Gun):
@@ -832,10 +2823,10 @@ class MachineGun(Gun):
         else:
             return None
 
-        Bullet(w, h, 5, 5, velocity_x, velocity_y, self.damage,
-               ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'], self)
+        projectiles.spawn_bullet(w, h, 5, 5, velocity_x, velocity_y, self.damage,
+                                 ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'], self)
 
-        self.time = datetime.datetime.now()
+        self.time = game_clock.now
 
 
 class Rifle(Gun):
@@ -875,242 +2866,472 @@ class Rifle(Gun):
         else:
             return None
 
-        Bullet(w, h, 7, 7, velocity_x, velocity_y, self.damage,
-               ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'], self)
+        projectiles.spawn_bullet(w, h, 7, 7, velocity_x, velocity_y, self.damage,
+                                 ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'], self)
 
-        self.time = datetime.datetime.now()
+        self.time = game_clock.now
 
 
-class Bullet(pygame.sprite.Sprite, GameObject):
+class ProjectileSystem:
     """
-    Пуля, летящяя по прямой с константной скоростью
+    Хранилище всех пуль в виде массивов numpy (по массиву на каждое свойство),
+     движение, наведение, столкновения со стенами и уничтожение пуль считаются сразу для всех пуль
+    Виды пуль:
+        BULLET - пуля, летящая по прямой с константной скоростью
+        SUPER_BULLET - пуля, изменяющая свое направление к target, но с константной скоростью
+        INERT_BULLET - пуля, изменяющая свое направление к target и с меняющееся скоростью
     Attributes:
-        Аттрибуты класса GameObject
-        velocity_x: float
-            Скорость объекта по оси абсцисс
-        velocity_y: float
-            Скорость объекта по оси ординат
-        time_of_live: float
-            Максимальное время, которое может существовать объект (в секундах)
-        carrier_gun: GameObject
-            Объект, носитель оружия, из которого был произведен выстрел данной пули
+        capacity: int
+            Размер массивов, при нехватке места увеличивается вдвое
+        count: int
+            Количество используемых ячеек массивов (живые пули находятся среди первых count ячеек)
+        free: list
+            Номера освободившихся ячеек, которые будут заняты новыми пулями
+        alive: np.ndarray
+            Показывает, существует ли пуля в ячейке
+        x, y: np.ndarray
+            Позиции левых верхних углов пуль
+        previous_x, previous_y: np.ndarray
+            Позиции пуль на начало шага симуляции, пули рисуются между ними и (x, y) (camera.alpha)
+        velocity_x, velocity_y: np.ndarray
+            Скорости пуль
+        width, height: np.ndarray
+            Размеры пуль
+        damage: np.ndarray
+            Урон пуль
+        age: np.ndarray
+            Время, которое существует пуля (в секундах)
+        time_of_live: np.ndarray
+            Максимальное время, которое может существовать пуля (в секундах)
+        kind: np.ndarray
+            Вид пули
+        velocity: np.ndarray
+            Векторная скорость пули (для SUPER_BULLET)
+        delta_velocity: np.ndarray
+            Длина вектора, на который пуля меняет свою траекторию
+        target: np.ndarray
+            Номер цели пули в targets, -1 - цели нет
+        object_mask: np.ndarray
+            Маска тегов пули
+        collision_mask: np.ndarray
+            Маска тегов коллизии пули
+        of_character: np.ndarray
+            Показывает, выпущена ли пуля из оружия (carrier_gun), при уничтожении такой пули создается Event
+        targets: list
+            Объекты, на которые наводятся пули
+        hits: int
+            Количество пуль, занявших освободившуюся ячейку (пул ячеек, как в ObjectPool)
+        misses: int
+            Количество пуль, для которых понадобилась новая ячейка
+        in_use: int
+            Количество живых пуль
+        high_water: int
+            Наибольшее значение in_use
+        object_masks: int
+            Объединение масок тегов всех когда-либо созданных пуль, для быстрого отказа в query
+        collision_masks: int
+            Объединение масок тегов коллизий всех когда-либо созданных пуль
+        image: pygame.Surface
+            Общая для всех пуль поверхность, каждая пуля рисуется ее частью нужного размера
     Methods:
-        update(tick=0)
-            Если объект стелкнулся с коллизией с тегом Wall или
-            прошло время максимальное время жизни уничтожает объект
-            Сдвигает объект по по горизнтали и вертикали
-        _kill()
-            Уничтожает объект
+        spawn_bullet(x, y, width, height, velocity_x, velocity_y, damage, tags, tags_of_collision, carrier_gun)
+            Создает пулю BULLET (аргументы как у прежнего конструктора Bullet)
+        spawn_batch(kind, x, y, width, height, velocity_x, velocity_y, damage, tags, tags_of_collision,
+         target, delta_velocity, time_of_live)
+            Создает сразу несколько пуль вида kind с одинаковыми тегами, числовые аргументы - массивы или числа,
+             возвращает номера пуль
+        save_position()
+            Запоминает позиции всех пуль в начале шага симуляции
+        update(tick)
+            Уничтожает пули, у которых вышло время жизни или которые улетели за пределы загруженных клеток,
+             наводит SUPER_BULLET и INERT_BULLET на цели, сдвигает все пули,
+             пули, задевшие стену на своем пути за шаг (sweep), останавливаются в точке удара и уничтожаются
+        sweep(active, delta_x, delta_y)
+            Для пуль active, сдвигающихся на (delta_x, delta_y), возвращает долю пути (от 0 до 1),
+             пройденную до первого касания стены (np.inf - пуля не заденет стену),
+             каждая пуля проверяется только со стенами из ячеек spatial_hash, которые она заметает за шаг
+        query(x, y, width, height, object_mask, collision_mask)
+            Возвращает список Projectile - пуль, пересекающих прямоугольник и имеющих нужные теги
+        kill(indexes)
+            Уничтожает пули с номерами indexes
+        draw(surface, camera, dirty=None)
+            Рисует все пули, видимые камерой, возвращает (сколько нарисовано, сколько пропущено),
+             прямоугольники пуль добавляются в dirty, если он передан
+        stats()
+            Возвращает словарь со счетчиками ячеек, как ObjectPool.stats
     """
+    BULLET, SUPER_BULLET, INERT_BULLET = 0, 1, 2
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.count = 0
+        self.free = []
+        self.targets = []
+        self.object_masks = self.collision_masks = 0
+        self.hits = self.misses = 0
+        self.in_use = self.high_water = 0
+
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.previous_x = np.zeros(capacity)
+        self.previous_y = np.zeros(capacity)
+        self.velocity_x = np.zeros(capacity)
+        self.velocity_y = np.zeros(capacity)
+        self.width = np.zeros(capacity)
+        self.height = np.zeros(capacity)
+        self.damage = np.zeros(capacity, dtype=np.int64)
+        self.age = np.zeros(capacity)
+        self.time_of_live = np.zeros(capacity)
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.velocity = np.zeros(capacity)
+        self.delta_velocity = np.zeros(capacity)
+        self.target = np.full(capacity, -1, dtype=np.int32)
+        self.object_mask = np.zeros(capacity, dtype=np.int64)
+        self.collision_mask = np.zeros(capacity, dtype=np.int64)
+        self.of_character = np.zeros(capacity, dtype=bool)
+
+        self.image = pygame.Surface((32, 32))
+        self.image.fill(GameObject.COLOR)
+
+    def _grow(self):
+        for name in ('alive', 'x', 'y', 'previous_x', 'previous_y', 'velocity_x', 'velocity_y', 'width', 'height',
+                     'damage', 'age', 'time_of_live', 'kind', 'velocity', 'delta_velocity', 'target', 'object_mask',
+                     'collision_mask', 'of_character'):
+            array = getattr(self, name)
+            new_array = np.zeros(self.capacity * 2, dtype=array.dtype)
+            new_array[:self.capacity] = array
+            if name == 'target':
+                new_array[self.capacity:] = -1
+            setattr(self, name, new_array)
+        self.capacity *= 2
+
+    def _target_index(self, target):
+        for index in range(len(self.targets)):
+            if self.targets[index] is target:
+                return index
+        self.targets.append(target)
+        return len(self.targets) - 1
+
+    def _allocate(self, n):
+        reused = min(n, len(self.free))
+        indexes = [self.free.pop() for _ in range(reused)]
+        while self.count + n - reused > self.capacity:
+            self._grow()
+        indexes.extend(range(self.count, self.count + n - reused))
+        self.count += n - reused
+        self.hits += reused
+        self.misses += n - reused
+        self.in_use += n
+        self.high_water = max(self.high_water, self.in_use)
+        return indexes
+
+    def spawn(self, kind, x, y, width, height, velocity_x, velocity_y, damage, tags, tags_of_collision,
+              carrier_gun=None, target=None, delta_velocity=0, time_of_live=1):
+        index = self._allocate(1)[0]
+
+        object_mask = Tags.mask_of(tags) | TAG_BULLET
+        collision_mask = Tags.mask_of(tags_of_collision)
+        self.object_masks |= object_mask
+        self.collision_masks |= collision_mask
+
+        self.alive[index] = True
+        self.x[index], self.y[index] = self.previous_x[index], self.previous_y[index] = x, y
+        self.velocity_x[index], self.velocity_y[index] = velocity_x, velocity_y
+        self.width[index], self.height[index] = width, height
+        self.damage[index] = damage
+        self.age[index], self.time_of_live[index] = 0, time_of_live
+        self.kind[index] = kind
+        self.velocity[index] = math.sqrt(velocity_x ** 2 + velocity_y ** 2)
+        self.delta_velocity[index] = delta_velocity
+        self.target[index] = -1 if target is None else self._target_index(target)
+        self.object_mask[index], self.collision_mask[index] = object_mask, collision_mask
+        self.of_character[index] = carrier_gun is not None
+        return index
+
+    def spawn_batch(self, kind, x, y, width, height, velocity_x, velocity_y, damage, tags, tags_of_collision,
+                    target=None, delta_velocity=0, time_of_live=1):
+        indexes = np.array(self._allocate(len(x)), dtype=np.int64)
+
+        object_mask = Tags.mask_of(tags) | TAG_BULLET
+        collision_mask = Tags.mask_of(tags_of_collision)
+        self.object_masks |= object_mask
+        self.collision_masks |= collision_mask
+
+        self.alive[indexes] = True
+        self.x[indexes], self.y[indexes] = self.previous_x[indexes], self.previous_y[indexes] = x, y
+        self.velocity_x[indexes], self.velocity_y[indexes] = velocity_x, velocity_y
+        self.width[indexes], self.height[indexes] = width, height
+        self.damage[indexes] = damage
+        self.age[indexes], self.time_of_live[indexes] = 0, time_of_live
+        self.kind[indexes] = kind
+        self.velocity[indexes] = np.hypot(velocity_x, velocity_y)
+        self.delta_velocity[indexes] = delta_velocity
+        self.target[indexes] = -1 if target is None else self._target_index(target)
+        self.object_mask[indexes], self.collision_mask[indexes] = object_mask, collision_mask
+        self.of_character[indexes] = False
+        return indexes
+
+    def spawn_bullet(self, x=0, y=0, width=0, height=0, velocity_x=0, velocity_y=0, damage=0,
+                     tags=None, tags_of_collision=None, carrier_gun=None):
+        return self.spawn(ProjectileSystem.BULLET, x, y, width, height, velocity_x, velocity_y, damage,
+                          tags, tags_of_collision, carrier_gun)
+
+    def kill(self, indexes):
+        indexes = np.asarray(indexes, dtype=np.int64)
+        indexes = indexes[self.alive[indexes]]
+        if not len(indexes):
+            return
 
-    def __init__(self, x=0, y=0, width=0, height=0, velocity_x=0, velocity_y=0, damage=0,
-                 tags=None, tags_of_collision=None, carrier_gun=None):
-        if tags is None:
-            tags = []
-        if tags_of_collision is None:
-            tags_of_collision = []
-        pygame.sprite.Sprite.__init__(self, all_gameObjects)
-        GameObject.__init__(self, x, y, width, height)
-        self.image = pygame.Surface((width, height),
-                                    pygame.SRCALPHA, 32)
-        pygame.draw.rect(self.image, [252, 247, 190],
-                         (0, 0, width, height))
-
-        self.tags = tags
-        self.tags.append('Bullet')
-        self.collision.tags = tags_of_collision
-
-        self.velocity_x, self.velocity_y = velocity_x, velocity_y
-        self.damage = damage
-        self.time_of_live = 1
-        self.carrier_gun = carrier_gun
-
-    def update(self, tick=0):
-        self.collision.update()
-        if datetime.datetime.now().second - self.time.second > self.time_of_live or self.collision.can_move_collisions(
-                needed_tags_of_collision=['Wall']):
-            self._kill()
-
-        self.x += self.velocity_x * tick
-        self.y += self.velocity_y * tick
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
-
-    def _kill(self):
         global event_controller
-        if self.carrier_gun:
+        for index in indexes[self.of_character[indexes]].tolist():
             event_controller.add_event(Event(tags=['Bullet death', 'Bullet of character'],
-                                             x=self.x + self.width // 2, y=self.y + self.height // 2))
-        self.collision.kill()
-        self.kill()
+                                             x=self.x[index] + self.width[index] // 2,
+                                             y=self.y[index] + self.height[index] // 2))
+        self._free(indexes)
+
+    def _free(self, indexes):
+        if not len(indexes):
+            return
+        self.alive[indexes] = False
+        self.target[indexes] = -1
+        self.free.extend(indexes.tolist())
+        self.in_use -= len(indexes)
+
+        count = self.count
+        while self.count and not self.alive[self.count - 1]:
+            self.count -= 1
+        if self.count < count:
+            self.free = [index for index in self.free if index < self.count]
+
+    def sweep(self, active, delta_x, delta_y):
+        time = np.full(len(active), np.inf)
+        if not len(active):
+            return time
+        x, y = self.x[active], self.y[active]
+        width, height = self.width[active], self.height[active]
+        size = spatial_hash.cell_size
+        # Ячейки spatial_hash, которые заметает каждая пуля за шаг, пары (пуля, ячейка)
+        cell_left = np.floor_divide(np.minimum(x, x + delta_x), size).astype(np.int64)
+        cell_top = np.floor_divide(np.minimum(y, y + delta_y), size).astype(np.int64)
+        span_x = np.floor_divide(np.maximum(x, x + delta_x) + width, size).astype(np.int64) - cell_left + 1
+        span_y = np.floor_divide(np.maximum(y, y + delta_y) + height, size).astype(np.int64) - cell_top + 1
+        bullets, local = self._expand(span_x * span_y)
+        cell_x = cell_left[bullets] + local % span_x[bullets]
+        cell_y = cell_top[bullets] + local // span_x[bullets]
+        min_x, min_y = int(cell_x.min()), int(cell_y.min())
+        rows = int(cell_y.max()) - min_y + 1
+        keys, inverse = np.unique((cell_x - min_x) * rows + cell_y - min_y, return_inverse=True)
+
+        # Стены берутся только из затронутых ячеек: для каждой ячейки - срез wall_indexes
+        walls, wall_numbers, wall_indexes, starts, counts = [], {}, [], [], []
+        for key in keys.tolist():
+            starts.append(len(wall_indexes))
+            cell = spatial_hash.cells.get((key // rows + min_x, key % rows + min_y))
+            for collision in cell or ():
+                if collision.tags.mask & TAG_WALL and collision.rect.width and collision.rect.height:
+                    if collision not in wall_numbers:
+                        wall_numbers[collision] = len(walls)
+                        walls.append(collision.rect)
+                    wall_indexes.append(wall_numbers[collision])
+            counts.append(len(wall_indexes) - starts[-1])
+        if not walls:
+            return time
+
+        counts = np.array(counts, dtype=np.int64)[inverse]
+        pair_cells, pair_local = self._expand(counts)
+        pair_bullets = bullets[pair_cells]
+        pair_walls = np.array(wall_indexes, dtype=np.int64)[np.array(starts, dtype=np.int64)[inverse][pair_cells] +
+                                                            pair_local]
+        rects = np.array([(rect.x, rect.y, rect.right, rect.bottom) for rect in walls], dtype=float)[pair_walls]
+        # Стены расширяются на размер пули, тогда пуля - это точка (ее левый верхний угол),
+        #  движущаяся по отрезку, и нужно найти, когда отрезок входит в прямоугольник
+        entry_x, exit_x = self._slab(x[pair_bullets], delta_x[pair_bullets], rects[:, 0] - width[pair_bullets],
+                                     rects[:, 2])
+        entry_y, exit_y = self._slab(y[pair_bullets], delta_y[pair_bullets], rects[:, 1] - height[pair_bullets],
+                                     rects[:, 3])
+        entry, exit_ = np.maximum(entry_x, entry_y), np.minimum(exit_x, exit_y)
+        hit = (entry < exit_) & (exit_ > 0) & (entry <= 1)
+        if hit.any():
+            np.minimum.at(time, pair_bullets[hit], np.maximum(entry[hit], 0))
+        return time
+
+    @staticmethod
+    def _expand(counts):
+        # Для counts = [2, 0, 3] возвращает номера [0, 0, 2, 2, 2] и порядковые номера внутри них [0, 1, 0, 1, 2]
+        owners = np.repeat(np.arange(len(counts)), counts)
+        return owners, np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    @staticmethod
+    def _slab(position, delta, low, high):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            time_low, time_high = (low - position) / delta, (high - position) / delta
+        still = np.broadcast_to(delta == 0, time_low.shape)
+        inside = (position > low) & (position < high)
+        entry = np.where(still, np.where(inside, -np.inf, np.inf), np.minimum(time_low, time_high))
+        exit_ = np.where(still, np.where(inside, np.inf, -np.inf), np.maximum(time_low, time_high))
+        return entry, exit_
+
+    def save_position(self):
+        self.previous_x[:self.count] = self.x[:self.count]
+        self.previous_y[:self.count] = self.y[:self.count]
 
-
-class SuperBullet(pygame.sprite.Sprite, GameObject):
+    def update(self, tick=0):
+        active = np.flatnonzero(self.alive[:self.count])
+        if not len(active):
+            return
+
+        self.age[active] += tick
+        off_world = (np.abs(self.x[active] - camera.offset_x - CAMERA_WIDTH // 2) > WIDTH * 3 // 2) | \
+                    (np.abs(self.y[active] - camera.offset_y - CAMERA_HEIGHT // 2) > HEIGHT * 3 // 2)
+        if off_world.any():
+            self._free(active[off_world])
+            active = active[~off_world]
+        if not len(active):
+            return
+
+        dead = self.age[active] > self.time_of_live[active]
+        if dead.any():
+            self.kill(active[dead])
+            active = active[~dead]
+
+        homing = active[self.target[active] >= 0]
+        if len(homing):
+            targets = np.array([[target.x, target.y, target.width, target.height] for target in self.targets],
+                               dtype=float)
+            target = targets[self.target[homing]]
+            super_bullets = self.kind[homing] == ProjectileSystem.SUPER_BULLET
+
+            # SUPER_BULLET целится в центр цели, INERT_BULLET - в левый верхний угол
+            distance_x = np.where(super_bullets, target[:, 0] + target[:, 2] // 2 -
+                                  (self.x[homing] + self.width[homing] // 2), target[:, 0] - self.x[homing])
+            distance_y = np.where(super_bullets, target[:, 1] + target[:, 3] // 2 -
+                                  (self.y[homing] + self.height[homing] // 2), target[:, 1] - self.y[homing])
+            distance = np.hypot(distance_x, distance_y)
+            distance[distance == 0] = 1
+            velocity_x = self.velocity_x[homing] + distance_x * self.delta_velocity[homing] / distance
+            velocity_y = self.velocity_y[homing] + distance_y * self.delta_velocity[homing] / distance
+
+            size_of_vector = np.hypot(velocity_x, velocity_y)
+            size_of_vector[size_of_vector == 0] = 1
+            scale = np.where(super_bullets, self.velocity[homing] / size_of_vector, 1)
+            self.velocity_x[homing] = velocity_x * scale
+            self.velocity_y[homing] = velocity_y * scale
+
+        delta_x, delta_y = self.velocity_x[active] * tick, self.velocity_y[active] * tick
+        time = self.sweep(active, delta_x, delta_y)
+        scale = np.minimum(time, 1)
+        self.x[active] += delta_x * scale
+        self.y[active] += delta_y * scale
+        hit = time <= 1
+        if hit.any():
+            self.kill(active[hit])
+
+    def query(self, x, y, width, height, object_mask=0, collision_mask=0):
+        if not self.count or width <= 0 or height <= 0 or \
+                object_mask & ~self.object_masks or collision_mask & ~self.collision_masks:
+            return []
+
+        n = self.count
+        hit = self.alive[:n] & (self.x[:n] < x + width) & (self.x[:n] + self.width[:n] > x) & \
+            (self.y[:n] < y + height) & (self.y[:n] + self.height[:n] > y)
+        if object_mask:
+            hit &= self.object_mask[:n] & object_mask == object_mask
+        if collision_mask:
+            hit &= self.collision_mask[:n] & collision_mask == collision_mask
+
+        return [Projectile(self, index).collision for index in np.flatnonzero(hit).tolist()]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'in_use': self.in_use, 'high_water': self.high_water,
+                'free': len(self.free)}
+
+    def draw(self, surface, camera, dirty=None):
+        n = self.count
+        offset_x, offset_y = camera.draw_offset()
+        x = self.previous_x[:n] + (self.x[:n] - self.previous_x[:n]) * camera.alpha - offset_x
+        y = self.previous_y[:n] + (self.y[:n] - self.previous_y[:n]) * camera.alpha - offset_y
+        visible = np.flatnonzero(self.alive[:n] & (x < CAMERA_WIDTH) & (x + self.width[:n] > 0) &
+                                 (y < CAMERA_HEIGHT) & (y + self.height[:n] > 0))
+        skipped = self.in_use - len(visible)
+        if not len(visible):
+            return 0, skipped
+        image = self.image
+        rects = surface.blits([(image, (x, y), (0, 0, width, height)) for x, y, width, height in
+                               zip(x[visible].tolist(), y[visible].tolist(),
+                                   self.width[visible].tolist(), self.height[visible].tolist())],
+                              doreturn=dirty is not None)
+        if dirty is not None:
+            dirty.extend(rects)
+        return len(visible), skipped
+
+
+class Projectile:
+    """
+    Легкая ссылка на пулю из ProjectileSystem, которую возвращает query, повторяет интерфейс
+     GameObject, поэтому с пулей, в которую попал объект, можно обращаться как с обычным объектом
+    Attributes:
+        system: ProjectileSystem
+            Хранилище пули
+        index: int
+            Номер пули в хранилище
+        collision: ProjectileCollision
+            Коллизия пули
+        tags: Tags
+            Теги пули
+    Methods:
+        _kill()
+            Уничтожает пулю
     """
-        Пуля, изменяющая свое направление, но с константной скоростью
-        Attributes:
-            Аттрибуты класса GameObject
-            velocity_x: float
-                Скорость объекта по оси абсцисс
-            velocity_y: float
-                Скорость объекта по оси ординат
-            velocity: float
-                Векторная скорость пули
-            time_of_live: float
-                Максимальное время, которое может существовать объект (в секундах)
-            carrier_gun: GameObject
-                Объект, носитель оружия, из которого был произведен выстрел данной пули
-            target: GameObject
-                Объект, который направляется пуля
-            delta_velocity: float
-                Длина вектор на который пуля меняет свою траекторию
-        Methods:
-            update(tick=0)
-                Если объект стелкнулся с коллизией с тегом Wall или
-                прошло время максимальное время жизни уничтожает объект
-                Прибавляет к вектору скорости пули ветор с модулем равным delta_velocity
-                и я направлением из координат объекта до координат target
-                Нормализует вектор скорости объекта
-                Сдвигает объект по по горизнтали и вертикали
-            _kill()
-                Уничтожает объект
-        """
-
-    def __init__(self, target, x=0, y=0, width=0, height=0, velocity_x=0, velocity_y=0,
-                 delta_velocity=0, damage=0, tags=None, tags_of_collision=None):
-        if tags is None:
-            tags = []
-        if tags_of_collision is None:
-            tags_of_collision = []
-        pygame.sprite.Sprite.__init__(self, all_gameObjects)
-        GameObject.__init__(self, x, y, width, height)
-        self.image = pygame.Surface((width, height),
-                                    pygame.SRCALPHA, 32)
-        pygame.draw.rect(self.image, [252, 247, 190],
-                         (0, 0, width, height))
 
-        self.tags = tags
-        self.tags.append('Bullet')
-        self.collision.tags = tags_of_collision
+    def __init__(self, system, index):
+        self.system, self.index = system, index
+        self.collision = ProjectileCollision(self)
 
-        self.damage = 10
-        self.velocity_x, self.velocity_y = velocity_x, velocity_y
-        self.velocity = math.sqrt(velocity_x ** 2 + velocity_y ** 2)
+    @property
+    def x(self):
+        return float(self.system.x[self.index])
 
-        self.start_time = datetime.datetime.now()
-        self.damage = damage
-        self.target, self.delta_velocity = target, delta_velocity
+    @property
+    def y(self):
+        return float(self.system.y[self.index])
 
-    def update(self, tick=0):
-        self.collision.update()
-        if datetime.datetime.now().second - self.start_time.second > 3 or self.collision.can_move_collisions(
-                needed_tags_of_collision=['Wall']):
-            self._kill()
-        c = (self.distance_x(self.target) * self.delta_velocity / self.distance(self.target),
-             self.distance_y(self.target) * self.delta_velocity / self.distance(self.target))
-        self.velocity_x += c[0]
-        self.velocity_y += c[1]
-        size_of_vector = math.sqrt(self.velocity_x ** 2 + self.velocity_y ** 2)
-
-        self.velocity_x *= self.velocity / size_of_vector
-        self.velocity_y *= self.velocity / size_of_vector
-
-        self.x += self.velocity_x * tick
-        self.y += self.velocity_y * tick
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+    @property
+    def width(self):
+        return float(self.system.width[self.index])
 
-    def distance(self, target):
-        return math.sqrt(self.distance_x(target) ** 2 + self.distance_y(target) ** 2)
+    @property
+    def height(self):
+        return float(self.system.height[self.index])
 
-    def distance_x(self, target):
-        return target.x + target.width // 2 - (self.x + self.width // 2)
+    @property
+    def damage(self):
+        return int(self.system.damage[self.index])
 
-    def distance_y(self, target):
-        return target.y + target.height // 2 - (self.y + self.height // 2)
+    @property
+    def tags(self):
+        return Tags.from_mask(int(self.system.object_mask[self.index]))
 
     def _kill(self):
-        self.collision.kill()
-        self.kill()
+        self.system.kill([self.index])
 
 
-class InertBullet(pygame.sprite.Sprite, GameObject):
-    """
-            Пуля, изменяющая свое направление и с меняющееся скоростью
-            Attributes:
-                Аттрибуты класса GameObject
-                velocity_x: float
-                    Скорость объекта по оси абсцисс
-                velocity_y: float
-                    Скорость объекта по оси ординат
-                velocity: float
-                    Векторная скорость пули
-                time_of_live: float
-                    Максимальное время, которое может существовать объект (в секундах)
-                carrier_gun: GameObject
-                    Объект, носитель оружия, из которого был произведен выстрел данной пули
-                target: GameObject
-                    Объект, который направляется пуля
-                delta_velocity: float
-                    Длина вектор на который пуля меняет свою траекторию
-            Methods:
-                update(tick=0)
-                    Если объект стелкнулся с коллизией с тегом Wall или
-                    прошло время максимальное время жизни уничтожает объект
-                    Прибавляет к вектору скорости пули ветор с модулем равным delta_velocity
-                    и я направлением из координат объекта до координат target
-                    Сдвигает объект по по горизнтали и вертикали
-                _kill()
-                    Уничтожает объект
-            """
-
-    def __init__(self, target, x=0, y=0, width=0, height=0, velocity_x=0, velocity_y=0,
-                 delta_velocity=0, damage=0, tags=None, tags_of_collision=None):
-        if tags is None:
-            tags = []
-        if tags_of_collision is None:
-            tags_of_collision = []
-        pygame.sprite.Sprite.__init__(self, all_gameObjects)
-        GameObject.__init__(self, x, y, width, height)
-        self.image = pygame.Surface((width, height),
-                                    pygame.SRCALPHA, 32)
-        pygame.draw.rect(self.image, [252, 247, 190],
-                         (0, 0, width, height))
-
-        self.tags = tags
-        self.tags.append('Bullet')
-        self.collision.tags = tags_of_collision
-
-        self.damage = 10
-        self.velocity_x, self.velocity_y = velocity_x, velocity_y
-        self.velocity = math.sqrt(velocity_x ** 2 + velocity_y ** 2)
-
-        self.start_time = datetime.datetime.now()
-        self.damage = damage
-        self.target, self.delta_velocity = target, delta_velocity
-
-    def update(self, tick=0):
-        self.collision.update()
-        if datetime.datetime.now().second - self.start_time.second > 3 or self.collision.can_move_collisions(
-                needed_tags_of_collision=['Wall']):
-            self.collision.kill()
-            self.kill()
-        c = (self.distance_x(self.target) * self.delta_velocity / self.distance(self.target),
-             self.distance_y(self.target) * self.delta_velocity / self.distance(self.target))
-
-        self.velocity_x += c[0]
-        self.velocity_y += c[1]
-
-        self.x += self.velocity_x * tick
-        self.y += self.velocity_y * tick
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
-
-    def distance(self, target):
-        return math.sqrt((self.x - target.x) ** 2 + (self.y - target.y) ** 2)
+class ProjectileCollision:
+    """
+    Коллизия пули из ProjectileSystem, повторяет интерфейс Collision
+    Attributes:
+        gameObject: Projectile
+            Пуля
+        tags: Tags
+            Теги коллизии пули
+    """
 
-    def distance_x(self, target):
-        return target.x - self.x
+    def __init__(self, projectile):
+        self.gameObject = projectile
 
-    def distance_y(self, target):
-        return target.y - self.y
+    @property
+    def tags(self):
+        return Tags.from_mask(int(self.gameObject.system.collision_mask[self.gameObject.index]))
 
 
 class Character(pygame.sprite.Sprite, GameObject):
@@ -1120,19 +3341,27 @@ class Character(pygame.sprite.Sprite, GameObject):
         self.image = load_image('Smile.png', [24, 28, 25])
 
         self.weapon = MachineGun(self)
+        self.input = input_source
 
         self.v = 500
 
         self.tags = ['Character', 'Indestructible']
         self.hp = 100
         self.coins = 0
-        self.time, self.time_between_enemy_attack = datetime.datetime.now(), 0.5
+        self.time, self.time_between_enemy_attack = game_clock.now, 0.5
 
+        self.weapon_changes = event_controller.subscribe(['Weapon change', 'Character'])
         self.items = [BulletPyro(1), Nothing(), Nothing()]
         for item in self.items:
             item.init(self)
 
-        self.font = pygame.font.Font(None, 35)
+        self.hp_inscription = all_inscriptions['Character'] = Inscription(35, x=10, y=10)
+        self.coins_inscription = all_inscriptions["Character's coins"] = Inscription(35, x=10, y=50)
+        self.fps_inscription = all_inscriptions['FPS: '] = Inscription(35, x=CAMERA_WIDTH - 150, y=10)
+        self.items_inscriptions = []
+        for index in range(len(self.items)):
+            self.items_inscriptions.append(Inscription(35, x=10, y=90 + index * font_pool.get(35).size('I')[1]))
+            all_inscriptions['Item ' + str(index)] = self.items_inscriptions[index]
 
         # self.collision.width, self.collision.height = 0, 0
 
@@ -1140,38 +3369,27 @@ class Character(pygame.sprite.Sprite, GameObject):
         for item in self.items:
             item.update()
 
-        text = self.font.render('Hp: ' + str(self.hp), True, [252, 247, 190])
-        all_inscriptions['Character'] = [text, 10, 10, self.font.size('Hp: ' + str(self.hp))[0],
-                                         self.font.size('Hp: ' + str(self.hp))[1]]
-        all_inscriptions["Character's coins"] = [self.font.render(f'Coins: {self.coins}', True, [252, 247, 190]), 10,
-                                                 50,
-                                                 self.font.size(f'Coins: {self.coins}')[0],
-                                                 self.font.size(f'Coins: {self.coins}')[1]]
-        all_inscriptions['FPS: '] = [self.font.render(f'FPS: {int(clock.get_fps())}', True, [252, 247, 190]),
-                                     CAMERA_WIDTH - 150, 10, self.font.size(f'FPS: {int(clock.get_fps())}')[0],
-                                     self.font.size(f'FPS: {int(clock.get_fps())}')[1]]
+        self.hp_inscription.set_text('Hp: ' + str(self.hp))
+        self.coins_inscription.set_text(f'Coins: {self.coins}')
+        self.fps_inscription.set_text(f'FPS: {int(clock.get_fps())}')
         for index in range(len(self.items)):
             self.items[index].update()
-            all_inscriptions['Item ' + str(index)] = [self.font.render(
-                f'Item {index + 1}: {self.items[index].name}', True, [252, 247, 190]), 10,
-                90 + index * (self.font.size('I')[1]),
-                self.font.size(f'Item {index + 1}: {self.items[index].name}')[0],
-                self.font.size(f'Item {index + 1}: {self.items[index].name}')[1]]
+            self.items_inscriptions[index].set_text(f'Item {index + 1}: {self.items[index].name}')
 
         for _collision in self.collision.can_move_collisions():
-            if 'Dangerous' in _collision.tags:
+            if _collision.tags.mask & TAG_DANGEROUS:
                 if self.wait(self.time, self.time_between_enemy_attack):
                     self.hp -= _collision.gameObject.damage
-                    self.time = datetime.datetime.now()
+                    self.time = game_clock.now
 
-                if 'One hit' in _collision.gameObject.tags:
+                if _collision.gameObject.tags.mask & TAG_ONE_HIT:
                     _collision.gameObject._kill()
 
-            if 'AidKid' in _collision.gameObject.tags:
+            if _collision.gameObject.tags.mask & TAG_AID_KID:
                 self.hp += _collision.gameObject.adding_of_hp
                 _collision.gameObject._kill(True)
 
-            if 'Dangerous' in _collision.tags or 'AidKid' in _collision.gameObject.tags:
+            if _collision.tags.mask & TAG_DANGEROUS or _collision.gameObject.tags.mask & TAG_AID_KID:
                 if self.hp >= 80:
                     self.image = load_image('Smile hp 80.png')
                 elif self.hp >= 40:
@@ -1179,11 +3397,11 @@ class Character(pygame.sprite.Sprite, GameObject):
                 elif self.hp >= 0:
                     self.image = load_image('Smile hp 0.png')
 
-            if 'Coin' in _collision.gameObject.tags:
+            if _collision.gameObject.tags.mask & TAG_COIN:
                 self.coins += 1
                 _collision.gameObject._kill()
 
-            if 'Item spawner' in _collision.gameObject.tags:
+            if _collision.gameObject.tags.mask & TAG_ITEM_SPAWNER:
                 if _collision.gameObject.was_purchase or self.coins >= _collision.gameObject.item.price:
                     if not _collision.gameObject.was_purchase:
                         self.coins -= _collision.gameObject.item.price
@@ -1197,13 +3415,11 @@ class Character(pygame.sprite.Sprite, GameObject):
                     self.items[0] = _item
                     self.items[0].init(self)
 
-                    _collision.gameObject.collision.width = 0
-                    _collision.gameObject.collision.height = 0
-                    _collision.gameObject.time = datetime.datetime.now()
+                    _collision.gameObject.hide_collision()
                     _collision.gameObject.item.price = 0
 
-        all_pressed = pygame.key.get_pressed()
-        for _event in event_controller.get_events(['Weapon change', 'Character'], self):
+        all_pressed = self.input.pressed()
+        for _event in self.weapon_changes.poll():
             self.weapon = _event.args['weapon'](self)
 
         delta_x, delta_y = 0, 0
@@ -1231,24 +3447,24 @@ class Character(pygame.sprite.Sprite, GameObject):
         self.collision.update()
 
         if self.hp <= 0:
-            font = pygame.font.Font(None, 250)
-            text = font.render('Game over', True, [252, 247, 190])
+            inscription = Inscription(250, 'Game over')
+            inscription.move((CAMERA_WIDTH - inscription.width) // 2, (CAMERA_HEIGHT - inscription.height) // 2)
             all_inscriptions.clear()
-            all_inscriptions['Game over'] = [text, (CAMERA_WIDTH - font.size(
-                'Game over')[0]) // 2, (CAMERA_HEIGHT - font.size('Game over')[1]) // 2,
-                                             font.size('Game over')[0], font.size('Game over')[1]]
+            all_inscriptions['Game over'] = inscription
 
             self.collision.kill()
             self.kill()
 
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+        self.sync_rect()
 
     def move(self, delta_x, delta_y):
-        if not self.collision.can_move_collisions(delta_x, delta_y, [], ['Wall']):
+        if not self.collision.can_move_collisions(delta_x, delta_y, 0, TAG_WALL):
             GameObject.translate(self, delta_x, delta_y)
 
 
 class Platform(pygame.sprite.Sprite, GameObject):
+    _layer = LAYER_WALLS
+
     def __init__(self, x, y, width, height, image, tags_of_game_object=None, tags_of_collision=None):
         if tags_of_game_object is None:
             tags_of_game_object = []
@@ -1268,10 +3484,6 @@ class Platform(pygame.sprite.Sprite, GameObject):
         self.collision.tags = tags_of_collision
         self.damage = 10
 
-    def update(self, tick=0):
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
-        self.collision.update()
-
     def _kill(self):
         self.collision.kill()
         self.kill()
@@ -1297,7 +3509,7 @@ class PatternPlatform:
                 Список тегов коллизии объекта
         Methods:
             init(delta_x, delta_y)
-                Создает объект Platform
+                Создает объект Platform и возвращает его
         """
 
     def __init__(self, x, y, width, height, image, tags_of_game_object=None, tags_of_collision=None):
@@ -1312,9 +3524,8 @@ class PatternPlatform:
         self.tags_of_collision = tags_of_collision
 
     def init(self, delta_x=0, delta_y=0):
-        Platform(self.x + (CAMERA_WIDTH - WIDTH) // 2 - camera.x + WIDTH * delta_x,
-                 self.y + (CAMERA_HEIGHT - HEIGHT) // 2 - camera.y - HEIGHT * delta_y,
-                 self.width, self.height, self.image, self.tags_of_game_object, self.tags_of_collision)
+        return Platform(*camera.room_position(self.x, self.y, delta_x, delta_y),
+                        self.width, self.height, self.image, self.tags_of_game_object, self.tags_of_collision)
 
 
 class AidKid(pygame.sprite.Sprite, GameObject):
@@ -1327,27 +3538,13 @@ class AidKid(pygame.sprite.Sprite, GameObject):
         self.adding_of_hp = 10
         self.tags = ['AidKid']
 
-        self.x_of_cell = self.y_of_cell = None
-
-    def update(self, tick=0):
-        self.collision.update()
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
-
     def kill_object(self):
         self.collision.kill()
         self.kill()
 
     def _kill(self, forever=False):
-        if forever and self.x_of_cell is not None and self.y_of_cell is not None:
-            for index in range(len(world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                                       world_generator.character_cell[1] + self.y_of_cell])):
-                if type(world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                            world_generator.character_cell[1] + self.y_of_cell][index][0]) == PatternAidKid and \
-                        world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                            world_generator.character_cell[1] + self.y_of_cell][index][1] == 1:
-                    world_generator.cells[world_generator.character_cell[0] + self.x_of_cell][
-                        world_generator.character_cell[1] + self.y_of_cell].pop(index)
-                    break
+        if forever and self.slot is not None:
+            world_generator.forget(self.slot)
 
         self.collision.kill()
         self.kill()
@@ -1363,62 +3560,53 @@ class PatternAidKid:
                 Позиция объекта по оси ординат, если бы игрок находился по центру клетки, к которой располагается объект
         Methods:
             init(delta_x, delta_y)
-                Создает объект AidKid
+                Создает и возвращает объект AidKid
         """
 
     def __init__(self, x, y):
         self.x, self.y = x, y
 
     def init(self, delta_x, delta_y):
-        aid_kid = AidKid(self.x + (CAMERA_WIDTH - WIDTH) // 2 - camera.x + WIDTH * delta_x,
-                         self.y + (CAMERA_HEIGHT - HEIGHT) // 2 - camera.y - HEIGHT * delta_y)
-        aid_kid.x_of_cell = delta_x
-        aid_kid.y_of_cell = delta_x
+        return AidKid(*camera.room_position(self.x, self.y, delta_x, delta_y))
 
 
 class Spikes(pygame.sprite.Sprite, GameObject):
+    _layer = LAYER_FLOOR
+
     def __init__(self, x, y, width, height, image, start_delay, delay_to_life, delay_to_death):
         pygame.sprite.Sprite.__init__(self, all_gameObjects)
         GameObject.__init__(self, x, y, width, height)
 
-        self.image = load_image(image, GameObject.FON_COLOR)
+        self.image = load_image(image, GameObject.FON_COLOR, unique=True)
 
         self.damage = 10
 
         self.delay_to_life, self.delay_to_death = delay_to_life, delay_to_death
-        self.time = datetime.datetime.now()
-        self.delay = start_delay
         self.active = False
         self.image.set_alpha(0)
+        self.timer = None
         if self.delay_to_life == 0 and self.delay_to_death == 0:
             self.image.set_alpha(255)
             self.tags = self.collision.tags = ['Dangerous']
             self.active = True
-            self.delay = self.delay_to_death
-
-    def update(self, tick=0):
-        if not (self.delay_to_life == 0 and self.delay_to_death == 0):
-            self.wait(self.delay, self.active)
-
-        self.collision.update()
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
-
-    def wait(self, delay, active):
-        if datetime.datetime.now() - self.time >= datetime.timedelta(seconds=delay):
-            if not active:
-                self.image.set_alpha(255)
-                self.tags = self.collision.tags = ['Dangerous']
-                self.active = True
-                self.delay = self.delay_to_death
-            else:
-                self.image.set_alpha(0)
-                self.tags = self.collision.tags = []
-                self.active = False
-                self.delay = self.delay_to_life
+        else:
+            self.timer = game_clock.schedule(start_delay, self.switch)
 
-            self.time = datetime.datetime.now()
+    # Включает или выключает шипы и заводит таймер до следующего переключения
+    def switch(self):
+        if not self.active:
+            self.image.set_alpha(255)
+            self.tags = self.collision.tags = ['Dangerous']
+            self.active = True
+            self.timer = game_clock.schedule(self.delay_to_death, self.switch)
+        else:
+            self.image.set_alpha(0)
+            self.tags = self.collision.tags = []
+            self.active = False
+            self.timer = game_clock.schedule(self.delay_to_life, self.switch)
 
     def _kill(self):
+        game_clock.cancel(self.timer)
         self.collision.kill()
         self.kill()
 
@@ -1443,7 +3631,7 @@ class PatternSpikes:
                 Время, в течение которого объект включен
         Methods:
             init(delta_x, delta_y)
-                Создает объект Spikes
+                Создает объект Spikes и возвращает его
         """
 
     def __init__(self, x, y, width, height, image, start_delay=0, delay_to_life=0, delay_to_death=0):
@@ -1453,9 +3641,8 @@ class PatternSpikes:
         self.start_delay, self.delay_to_life, self.delay_to_death = start_delay, delay_to_life, delay_to_death
 
     def init(self, delta_x, delta_y):
-        Spikes(self.x + (CAMERA_WIDTH - WIDTH) // 2 - camera.x + WIDTH * delta_x,
-               self.y + (CAMERA_HEIGHT - HEIGHT) // 2 - camera.y - HEIGHT * delta_y, self.width, self.height,
-               self.image, self.start_delay, self.delay_to_life, self.delay_to_death)
+        return Spikes(*camera.room_position(self.x, self.y, delta_x, delta_y), self.width, self.height,
+                      self.image, self.start_delay, self.delay_to_life, self.delay_to_death)
 
 
 class Coin(pygame.sprite.Sprite, GameObject):
@@ -1467,9 +3654,12 @@ class Coin(pygame.sprite.Sprite, GameObject):
             Время, в течение которого объект существует
     Methods:
         update(tick=0)
-            Уничтожает объект, если прошло с создания времени больше чем time_of_live
-        kill()
-            Уничтожает объект
+            Обновляет положение коллизии
+            Через time_of_live после создания game_clock уничтожает объект
+        reset(x, y)
+            Подготавливает объект, взятый из Coin.pool, к повторному использованию
+        _kill()
+            Уничтожает объект и возвращает его в Coin.pool
     """
 
     def __init__(self, x, y):
@@ -1481,16 +3671,22 @@ class Coin(pygame.sprite.Sprite, GameObject):
         self.tags = ['Coin', 'Indestructible']
 
         self.time_of_live = 5
+        self.timer = game_clock.schedule(self.time_of_live, self._kill)
 
-    def update(self, tick=0):
-        self.collision.update()
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
-        if datetime.datetime.now() - self.time > datetime.timedelta(seconds=self.time_of_live):
-            self._kill()
+    def reset(self, x, y):
+        self.revive(x, y)
+        self.timer = game_clock.schedule(self.time_of_live, self._kill)
 
     def _kill(self):
+        if not self.alive():
+            return
+        game_clock.cancel(self.timer)
         self.collision.kill()
         self.kill()
+        Coin.pool.release(self)
+
+
+Coin.pool = ObjectPool(Coin)
 
 
 class Nothing(Item):
@@ -1571,7 +3767,7 @@ class Arsonist(Item):
     Класс предмета, создающего Fire на месте игрока
     Attributes:
         Атрибуты Item
-        time: deltatime.deltatime
+        time: float
             Время создания последего Fire
         delay: float
             Время, которое должно пройти с последнего создания Fire, чтобы создать Fire
@@ -1586,7 +3782,7 @@ class Arsonist(Item):
     def __init__(self, price):
         self.price = price
         self.name = "Arsonist"
-        self.time = datetime.datetime.now()
+        self.time = game_clock.now
         self.delay = 0.1
 
     def init(self, carrier):
@@ -1594,13 +3790,12 @@ class Arsonist(Item):
 
     def update(self):
         if self.wait(self.time, self.delay):
-            Fire(self.carrier.x + self.carrier.width // 2 - 25, self.carrier.y + self.carrier.height // 2 - 25,
-                 3, ['Dangerous for enemy'])
-            self.time = datetime.datetime.now()
+            Fire.pool.acquire(self.carrier.x + self.carrier.width // 2 - 25,
+                              self.carrier.y + self.carrier.height // 2 - 25, 3, ['Dangerous for enemy'])
+            self.time = game_clock.now
 
     def wait(self, time, delay):
-        if datetime.datetime.now() - time >= datetime.timedelta(seconds=delay):
-            return True
+        return game_clock.wait(time, delay)
 
 
 class BulletPyro(Item):
@@ -1622,11 +3817,12 @@ class BulletPyro(Item):
 
     def init(self, carrier):
         super().__init__(self.name, self.price, carrier)
+        self.bullet_deaths = event_controller.subscribe(['Bullet death', 'Bullet of character'])
 
     def update(self):
         global EVENTS
-        for _event in event_controller.get_events(['Bullet death', 'Bullet of character'], self.carrier):
-            Fire(_event.args['x'] - 25, _event.args['y'] - 25, 3, ['Dangerous for enemy'])
+        for _event in self.bullet_deaths.poll():
+            Fire.pool.acquire(_event.args['x'] - 25, _event.args['y'] - 25, 3, ['Dangerous for enemy'])
 
 
 class Shrapnel(Item):
@@ -1636,18 +3832,19 @@ class Shrapnel(Item):
 
     def init(self, carrier):
         super().__init__(self.name, self.price, carrier)
+        self.bullet_deaths = event_controller.subscribe(['Bullet death', 'Bullet of character'])
 
     def update(self):
         global EVENTS
-        for _event in event_controller.get_events(['Bullet death', 'Bullet of character'], self.carrier):
-            Bullet(_event.args['x'] + 10, _event.args['y'], 10, 10, 500, 0, 10,
-                   ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'])
-            Bullet(_event.args['x'] - 10, _event.args['y'], 10, 10, -500, 0, 10,
-                   ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'])
-            Bullet(_event.args['x'], _event.args['y'] + 10, 10, 10, 0, 500, 10,
-                   ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'])
-            Bullet(_event.args['x'], _event.args['y'] - 10, 10, 10, 0, -500, 10,
-                   ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'])
+        for _event in self.bullet_deaths.poll():
+            projectiles.spawn_bullet(_event.args['x'] + 10, _event.args['y'], 10, 10, 500, 0, 10,
+                                     ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'])
+            projectiles.spawn_bullet(_event.args['x'] - 10, _event.args['y'], 10, 10, -500, 0, 10,
+                                     ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'])
+            projectiles.spawn_bullet(_event.args['x'], _event.args['y'] + 10, 10, 10, 0, 500, 10,
+                                     ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'])
+            projectiles.spawn_bullet(_event.args['x'], _event.args['y'] - 10, 10, 10, 0, -500, 10,
+                                     ['Dangerous for enemy', 'Indestructible', 'One hit'], ['Dangerous for enemy'])
 
 
 class Fire(pygame.sprite.Sprite, GameObject):
@@ -1659,10 +3856,14 @@ class Fire(pygame.sprite.Sprite, GameObject):
             Время, в течение котого объект существует
     Methods:
         update(tick=0)
-            Уничтожает объект, если прошло время time_of_live
+            Обновляет положение коллизии
+            Через time_of_live после создания game_clock уничтожает объект
+        reset(x, y, time_of_life, tags)
+            Подготавливает объект, взятый из Fire.pool, к повторному использованию
         _kill()
-            Уничтожает объект
+            Уничтожает объект и возвращает его в Fire.pool
     """
+    _layer = LAYER_FLOOR
 
     def __init__(self, x, y, time_of_life, tags):
         pygame.sprite.Sprite.__init__(self, all_gameObjects)
@@ -1675,48 +3876,380 @@ class Fire(pygame.sprite.Sprite, GameObject):
         self.damage = 1
 
         self.time_of_life = time_of_life
+        self.timer = game_clock.schedule(self.time_of_life, self._kill)
 
-    def update(self, tick):
-        if self.wait(self.time, self.time_of_life):
-            self._kill()
-
-        self.collision.update()
-        self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
+    def reset(self, x, y, time_of_life, tags):
+        self.tags = tags + ['Indestructible']
+        self.collision.tags = tags
+        self.time_of_life = time_of_life
+        self.revive(x, y)
+        self.timer = game_clock.schedule(self.time_of_life, self._kill)
 
     def _kill(self):
+        if not self.alive():
+            return
+        game_clock.cancel(self.timer)
         self.collision.kill()
         self.kill()
+        Fire.pool.release(self)
+
+
+Fire.pool = ObjectPool(Fire)
+
+
+class FontPool:
+    """
+    Общий для всех объектов набор шрифтов, шрифт каждого размера создается один раз
+    Attributes:
+        fonts: dict
+            Словарь, ключ - размер шрифта, значение - pygame.font.Font
+    Methods:
+        get(size)
+            Возвращает шрифт размера size
+    """
 
+    def __init__(self):
+        self.fonts = {}
+
+    def get(self, size):
+        if size not in self.fonts:
+            self.fonts[size] = pygame.font.Font(None, size)
+        return self.fonts[size]
+
+
+class TextCache:
+    """
+    LRU-кэш отрисованных надписей, общий для всех шрифтов
+    Attributes:
+        font_pool: FontPool
+            Шрифты, которыми отрисовываются надписи
+        max_size: int
+            Максимальное количество хранимых надписей
+        surfaces: collections.OrderedDict
+            Ключ - (размер шрифта, текст, цвет), значение - отрисованная надпись,
+             последние использованные надписи находятся в конце
+    Methods:
+        render(size, text, color)
+            Возвращает отрисованную надпись, рисует ее только если ее нет в кэше
+    """
+
+    def __init__(self, font_pool, max_size=512):
+        self.font_pool = font_pool
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+
+    def render(self, size, text, color):
+        key = (size, text, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = self.surfaces[key] = self.font_pool.get(size).render(text, True, color)
+            if len(self.surfaces) > self.max_size:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+
+class Inscription:
+    """
+    Надпись, хранящаяся в all_inscriptions, перерисовывается только при изменении текста
+    Attributes:
+        size: int
+            Размер шрифта
+        color: list
+            Цвет надписи
+        text: str
+            Текст надписи
+        image: pygame.Surface
+            Отрисованный текст
+        x: float
+            Позиция левого верхнего угла надписи по оси абсцисс
+        y: float
+            Позиция левого верхнего угла надписи по оси ординат
+        in_world: bool
+            Если True, x и y - мировые координаты (надпись над объектом), иначе - экранные
+        width: int
+            Длина надписи
+        height: int
+            Высота надписи
+    Methods:
+        set_text(text)
+            Меняет текст надписи, если он отличается от текущего
+        move(x, y)
+            Перемещает надпись
+    """
+
+    def __init__(self, size, text='', color=None, x=0, y=0, in_world=False):
+        self.size = size
+        self.color = GameObject.COLOR if color is None else color
+        self.text = None
+        self.x, self.y = x, y
+        self.in_world = in_world
+        self.set_text(text)
+
+    def set_text(self, text):
+        if text == self.text:
+            return
+        self.text = text
+        self.image = text_cache.render(self.size, text, self.color)
+        self.width, self.height = self.image.get_size()
+
+    def move(self, x, y):
+        self.x, self.y = x, y
+
+
+class Benchmark:
+    """
+    Сценарий нагрузки для замера производительности, каждый сценарий запускается в отдельном процессе
+     (python main.py --headless --scenario=<имя>), чтобы начинать с чистого мира
+    Кадр - один шаг симуляции (simulate) и отрисовка в невидимый экран, первые warmup кадров не учитываются
+    Attributes:
+        SCENARIOS: list
+            Имена сценариев: turrets - TURRETS врагов Enemy1/Enemy2 стреляют в игрока,
+             machine_gun - непрерывный огонь MachineGun с Shrapnel и BulletPyro,
+             arsonist - игрок ходит с Arsonist и оставляет огонь,
+             crossings - игрок каждые CROSSING_PERIOD кадров переходит в соседнюю клетку и обратно,
+             explore - игрок по спирали обходит ROOMS клеток
+        METRICS: list
+            Метрики, которые сравниваются с сохраненным результатом
+        name: str
+            Имя сценария
+        limit: int или None
+            Число кадров, после которого сценарий заканчивается сам (None - по числу шагов)
+    Methods:
+        run(steps, warmup=60)
+            Прогоняет сценарий и возвращает словарь с перцентилями времени кадра (frame_ms),
+             симуляции (update_ms) и отрисовки (draw_ms), количеством объектов, пуль,
+             приростом выделенных блоков памяти за кадр и числом сборок мусора по поколениям
+        suite(names, steps, seed, output, baseline)
+            Запускает сценарии, пишет результаты в output (JSON) и, если задан baseline,
+             печатает изменения относительно него
+        compare(result, baseline, threshold=0.1)
+            Возвращает строки с изменением метрик, ухудшения больше threshold помечаются
+    """
 
-def load_image(name, color_key=None):
-    fullname = os.path.join('data/images', name)
-    if not os.path.isfile(fullname):
-        print(f"Файл с изображением '{fullname}' не найден")
-        sys.exit()
+    SCENARIOS = ['turrets', 'machine_gun', 'arsonist', 'crossings', 'explore']
+    METRICS = [('frame_ms', 'p50'), ('frame_ms', 'p95'), ('frame_ms', 'p99'),
+               ('update_ms', 'p50'), ('update_ms', 'p95'), ('update_ms', 'p99'),
+               ('draw_ms', 'p50'), ('draw_ms', 'p95'), ('draw_ms', 'p99'), ('blocks_per_frame', 'mean')]
+    TURRETS = 24
+    CROSSING_PERIOD = 20
+    ROOMS = 500
+    FRAMES_PER_ROOM = 4
+
+    def __init__(self, name):
+        if name not in self.SCENARIOS:
+            raise ValueError(f'Неизвестный сценарий {name}, есть: {", ".join(self.SCENARIOS)}')
+        self.name = name
+        self.limit = None
+        character.hp = 10 ** 9
+        character.input = ScriptedInput([])
+        getattr(self, 'setup_' + name)()
+
+    def equip(self, *items):
+        character.items = list(items) + [Nothing() for _ in range(3 - len(items))]
+        for item in character.items:
+            item.init(character)
+
+    def setup_turrets(self):
+        for index in range(self.TURRETS):
+            angle = 2 * math.pi * index / self.TURRETS
+            x = character.x + math.cos(angle) * 350
+            y = character.y + math.sin(angle) * 250
+            if index % 2:
+                Enemy2(x, y, 50, 50, 8)
+            else:
+                Enemy1(x, y, 50, 50)
+
+    def setup_machine_gun(self):
+        character.weapon = MachineGun(character)
+        self.equip(Shrapnel(0), BulletPyro(0))
+        character.input = ScriptedInput([(0, [pygame.K_LEFT]), (0.25, [pygame.K_UP]), (0.5, [pygame.K_RIGHT]),
+                                         (0.75, [pygame.K_DOWN])], loop=1)
+
+    def setup_arsonist(self):
+        self.equip(Arsonist(0))
+        character.input = ScriptedInput.wander(60, period=0.25, seed=SEED or 0)
+
+    def setup_crossings(self):
+        self.direction = 1
+
+    def frame_crossings(self, frame):
+        if frame % self.CROSSING_PERIOD == 0:
+            GameObject.translate(character, self.direction * WIDTH, 0)
+            self.direction = -self.direction
+
+    def setup_explore(self):
+        self.limit = self.ROOMS * self.FRAMES_PER_ROOM
+        self.path = self.spiral()
+
+    def frame_explore(self, frame):
+        if frame % self.FRAMES_PER_ROOM == 0:
+            delta_x, delta_y = next(self.path)
+            GameObject.translate(character, delta_x * WIDTH, delta_y * HEIGHT)
+
+    @staticmethod
+    def spiral():
+        direction_x, direction_y, length = 1, 0, 1
+        while True:
+            for _ in range(2):
+                for _ in range(length):
+                    yield direction_x, direction_y
+                direction_x, direction_y = -direction_y, direction_x
+            length += 1
+
+    def run(self, steps, warmup=60):
+        limit = self.limit or steps
+        frame_hook = getattr(self, 'frame_' + self.name, None)
+        collections = [0, 0, 0]
+
+        def count_collection(phase, info):
+            if phase == 'start':
+                collections[info['generation']] += 1
+
+        camera.alpha = 1
+        update_times, draw_times, objects, bullets, blocks = [], [], [], [], []
+        gc.callbacks.append(count_collection)
+        try:
+            for frame in range(warmup + limit):
+                if frame == warmup:
+                    collections[:] = [0, 0, 0]
+                if frame_hook is not None:
+                    frame_hook(frame)
+                pygame.event.pump()
+                allocated = sys.getallocatedblocks()
+                started = perf_counter()
+                simulate(game_clock.advance(fixed_timestep.step))
+                updated = perf_counter()
+                screen.fill([24, 28, 25])
+                all_gameObjects.draw(screen, camera)
+                drawn = perf_counter()
+                if frame < warmup:
+                    continue
+                update_times.append(updated - started)
+                draw_times.append(drawn - updated)
+                blocks.append(sys.getallocatedblocks() - allocated)
+                objects.append(len(all_gameObjects))
+                bullets.append(projectiles.stats()['in_use'])
+                profiler.end_frame()
+        finally:
+            gc.callbacks.remove(count_collection)
+
+        update_times, draw_times = np.array(update_times) * 1000, np.array(draw_times) * 1000
+
+        def percentiles(values):
+            return {name: round(float(np.percentile(values, q)), 4) for name, q in
+                    (('p50', 50), ('p95', 95), ('p99', 99))} | {'max': round(float(values.max()), 4)}
+
+        return {'frames': len(update_times), 'frame_ms': percentiles(update_times + draw_times),
+                'update_ms': percentiles(update_times), 'draw_ms': percentiles(draw_times),
+                'objects': {'mean': round(float(np.mean(objects)), 1), 'max': int(np.max(objects))},
+                'projectiles': {'mean': round(float(np.mean(bullets)), 1), 'max': int(np.max(bullets))},
+                'blocks_per_frame': {'mean': round(float(np.mean(blocks)), 2), 'max': int(np.max(blocks))},
+                'gc_collections': collections,
+                'rooms': len(world_generator.cells) + len(world_generator.records)} | \
+            ({'profile': profiler.stats()} if profiler.enabled else {})
+
+    @staticmethod
+    def suite(names, steps, seed, output, baseline=None):
+        results = {'python': sys.version.split()[0], 'pygame': pygame.version.ver, 'numpy': np.__version__,
+                   'steps': steps, 'seed': seed, 'scenarios': {}}
+        for name in names:
+            started = perf_counter()
+            process = subprocess.run([sys.executable, sys.argv[0], '--headless', f'--scenario={name}',
+                                      f'--steps={steps}', f'--seed={seed}'], capture_output=True, text=True)
+            if process.returncode:
+                print(process.stderr, file=sys.stderr)
+                raise RuntimeError(f'Сценарий {name} завершился с кодом {process.returncode}')
+            results['scenarios'][name] = json.loads(process.stdout.strip().splitlines()[-1])
+            frame_ms = results['scenarios'][name]['frame_ms']
+            print(f'{name}: p50 {frame_ms["p50"]} мс, p95 {frame_ms["p95"]} мс, p99 {frame_ms["p99"]} мс '
+                  f'({perf_counter() - started:.1f} с)')
+
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print(f'Результаты записаны в {output}')
+
+        if baseline is not None:
+            with open(baseline, encoding='utf-8') as file:
+                for line in Benchmark.compare(results, json.load(file)):
+                    print(line)
+        return results
+
+    @staticmethod
+    def compare(result, baseline, threshold=0.1):
+        lines = []
+        for name, scenario in result['scenarios'].items():
+            if name not in baseline['scenarios']:
+                lines.append(f'{name}: нет в сохраненном результате')
+                continue
+            for metric, key in Benchmark.METRICS:
+                old, new = baseline['scenarios'][name][metric][key], scenario[metric][key]
+                change = (new - old) / abs(old) if old else 0.0
+                mark = ' ХУЖЕ' if change > threshold else ' лучше' if change < -threshold else ''
+                lines.append(f'{name} {metric}.{key}: {old} -> {new} ({change:+.1%}){mark}')
+        return lines
+
+
+# Кэш уже загруженных изображений, ключ - (название, color_key)
+loaded_images = {}
+
+
+def load_image(name, color_key=None, unique=False):
+    """
+    Возвращает изображение из data/images, файл читается и конвертируется только при первом запросе,
+     дальше все объекты делят одну и ту же поверхность
+    unique=True возвращает копию, которую можно менять (например, прозрачность в Spikes),
+     не затрагивая остальные объекты
+    """
+    key = (name, tuple(color_key) if isinstance(color_key, (list, tuple)) else color_key)
+    if key not in loaded_images:
+        with tracer.span('load_image', image=name):
+            fullname = os.path.join('data/images', name)
+            if not os.path.isfile(fullname):
+                print(f"Файл с изображением '{fullname}' не найден")
+                sys.exit()
+
+            image = pygame.image.load(fullname)
+
+            if color_key is not None:
+                image = image.convert()
+                if color_key == -1:
+                    color_key = image.get_at((0, 0))
+                image.set_colorkey(color_key)
+            else:
+                image = image.convert_alpha()
 
-    image = pygame.image.load(fullname)
+            loaded_images[key] = image
 
-    if color_key is not None:
-        image = image.convert()
-        if color_key == -1:
-            color_key = image.get_at((0, 0))
-        image.set_colorkey(color_key)
-    else:
-        image = image.convert_alpha()
+    if unique:
+        return loaded_images[key].copy()
+    return loaded_images[key]
 
-    return image
 
+def preload_images(color_keys=(None, GameObject.FON_COLOR)):
+    """Заранее загружает все изображения из data/images во всех нужных вариантах color_key"""
+    for name in os.listdir('data/images'):
+        for color_key in color_keys:
+            load_image(name, color_key)
 
-def print_inscriptions():
-    for inscriptions in all_inscriptions.values():
-        pygame.draw.rect(screen, (24, 28, 25), (inscriptions[1], inscriptions[2],
-                                                inscriptions[3] - 1, inscriptions[4]))
-        screen.blit(inscriptions[0], [inscriptions[1], inscriptions[2]])
+
+def print_inscriptions(surface, camera, dirty=None):
+    with profiler.scope('inscriptions'):
+        for inscription in all_inscriptions.values():
+            x, y = camera.to_screen(inscription.x, inscription.y) if inscription.in_world else \
+                (inscription.x, inscription.y)
+            pygame.draw.rect(surface, (24, 28, 25), (x, y, inscription.width - 1, inscription.height))
+            surface.blit(inscription.image, [x, y])
+            if dirty is not None:
+                dirty.append(pygame.Rect(x, y, inscription.width, inscription.height))
+        return len(all_inscriptions), 0
 
 
 def load_fon(intro_text):
     pass
-    font = pygame.font.Font(None, 30)
+    font = font_pool.get(30)
     text_coord = 10
     for line in intro_text:
         string_rendered = font.render(line, 1, pygame.Color(GameObject.COLOR))
@@ -1728,9 +4261,44 @@ def load_fon(intro_text):
         screen.blit(string_rendered, intro_rect)
 
 
+# Режим без окна и без игрока: симуляция под драйвером dummy, управление по ScriptedInput,
+#  --input=<файл> (см. ScriptedInput.load), --steps=<число шагов>, --seed=<число>
+# --scenario=<имя> прогоняет один сценарий Benchmark и печатает результат в JSON
+SCENARIO = next((arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--scenario=')), None)
+# Запись партии для точного воспроизведения: --record=<файл>, воспроизведение без окна: --replay=<файл>
+RECORD = next((arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--record=')), None)
+REPLAY = next((arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--replay=')), None)
+HEADLESS = '--headless' in sys.argv or SCENARIO is not None or REPLAY is not None
+if HEADLESS:
+    os.environ['SDL_VIDEODRIVER'] = os.environ['SDL_AUDIODRIVER'] = 'dummy'
+SEED = next((int(arg.split('=', 1)[1]) for arg in sys.argv if arg.startswith('--seed=')), None)
+replay = InputReplay(REPLAY) if REPLAY is not None else None
+if replay is not None:
+    SEED = replay.seed
+elif RECORD is not None and SEED is None:
+    SEED = random.getrandbits(32)
+if SEED is not None:
+    random.seed(SEED)
+STEPS = next((int(arg.split('=', 1)[1]) for arg in sys.argv if arg.startswith('--steps=')), None)
+
+# Замер производительности: --benchmark[=сценарий,...] [--steps=N] [--seed=N]
+#  [--benchmark-output=файл] [--baseline=файл с прошлым результатом для сравнения]
+if any(arg == '--benchmark' or arg.startswith('--benchmark=') for arg in sys.argv):
+    Benchmark.suite(next((arg.split('=', 1)[1].split(',') for arg in sys.argv if arg.startswith('--benchmark=')),
+                         Benchmark.SCENARIOS), STEPS or 1200, SEED or 0,
+                    next((arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--benchmark-output=')),
+                         'benchmark.json'),
+                    next((arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--baseline=')), None))
+    sys.exit()
+
+# Запись временной шкалы кадров в формате Chrome trace: --trace=<файл.json>
+tracer = Tracer(next((arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--trace=')), None))
+
 con = sqlite3.connect('data/Pygame_DB.db')
 cur = con.cursor()
 pygame.init()
+font_pool = FontPool()
+text_cache = TextCache(font_pool)
 
 data = cur.execute("""SELECT * FROM passing""").fetchall()
 _id = cur.execute("""SELECT id FROM passing""").fetchall()[-1][0] + 1
@@ -1738,8 +4306,18 @@ _datetime = str(datetime.datetime.now())
 KILLS = 0
 
 SIZE = WIDTH, HEIGHT = 2000, 1000
+if '--compile-cells' in sys.argv:
+    compiled_cells = PatternStore({'WIDTH': WIDTH, 'HEIGHT': HEIGHT}).build()
+    print(f'Скомпилировано клеток: {len(compiled_cells)}')
+    con.close()
+    sys.exit()
+# Режим отрисовки только изменившихся частей экрана (для слабых машин без видеокарты)
+DIRTY_RECTS = '--dirty-rects' in sys.argv
+# Ограничение частоты кадров, например --fps-cap=60 (0 - без ограничения)
+FPS_CAP = next((int(arg.split('=', 1)[1]) for arg in sys.argv if arg.startswith('--fps-cap=')), 0)
 CAMERA_WIDTH, CAMERA_HEIGHT = 1000, 600
 screen = pygame.display.set_mode([CAMERA_WIDTH, CAMERA_HEIGHT])
+preload_images()
 
 intro_text_1 = ["<Название проекта>", "",
                 "Нажмите Enter для начала игры",
@@ -1784,7 +4362,7 @@ size_x = size_y = 50
 cells = [[None for j in range(CAMERA_WIDTH // size_x)] for i in range(CAMERA_HEIGHT // size_y)]
 cells[5][5] = cells[5][6] = cells[5][7] = cells[4][7] = cells[3][6] = random.choice(images)
 time = datetime.datetime.now()
-running = True
+running = not HEADLESS
 while running:
     if datetime.datetime.now() - time > datetime.timedelta(seconds=0.2):
         time = datetime.datetime.now()
@@ -1830,54 +4408,247 @@ while running:
                         [event.pos[0] // size_x * size_x, event.pos[1] // size_y * size_y])
             pygame.display.flip()
 
-all_gameObjects = pygame.sprite.Group()
+# Заставка тратит случайные числа в зависимости от того, сколько она шла, поэтому зерно задается заново
+if SEED is not None:
+    random.seed(SEED)
+all_gameObjects = CameraGroup()
 all_collisions = pygame.sprite.Group()
+game_clock = GameClock()
+# Профилировщик кадра: F3 - показать замеры на экране, --profile - замерять с самого начала
+profiler = Profiler()
+profiler.tracer = tracer if tracer.enabled else None
+profiler.enabled = '--profile' in sys.argv or tracer.enabled
+spatial_hash = SpatialHash()
+projectiles = ProjectileSystem()
+turrets = TurretController()
 all_inscriptions = {}
 number_of_gameobjects = 0
 
+event_controller = EventController()
+if not HEADLESS:
+    input_source = KeyboardInput()
+elif any(arg.startswith('--input=') for arg in sys.argv):
+    input_source = ScriptedInput.load(next(arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--input=')))
+else:
+    input_source = ScriptedInput.wander(60, seed=SEED or 0)
+if replay is not None:
+    input_source = FrameInput()
+elif RECORD is not None:
+    input_source = FrameInput(input_source)
 character = Character(CAMERA_WIDTH // 2 - 39, CAMERA_HEIGHT // 2 - 50, 75, 75, all_gameObjects)
 camera = Camera()
 clock = pygame.time.Clock()
-world_generator = WorldGenerator(camera)
-event_controller = EventController()
+static_layer = StaticLayer() if DIRTY_RECTS else None
+world_generator = WorldGenerator(camera, static_layer)
+all_gameObjects.set_renderer(LAYER_PROJECTILES, projectiles.draw)
+all_gameObjects.set_renderer(LAYER_HUD, print_inscriptions)
+if DIRTY_RECTS:
+    all_gameObjects.hidden_layers.add(LAYER_WALLS)
+    dirty_renderer = DirtyRectRenderer(all_gameObjects, static_layer)
 
 weapons_of_character = [Gun, MachineGun, Rifle]
-
-running = True
+fixed_timestep = FixedTimestep(replay.step) if replay is not None else FixedTimestep()
+fixed_timestep.track(camera, character, projectiles)
+recorder = InputRecorder(RECORD, SEED, fixed_timestep.step) if RECORD is not None else None
+if recorder is not None or replay is not None:
+    world_generator.attach_limit = 8
+
+
+def simulate(tick):
+    """Один шаг симуляции длины tick, общий для игры и режима --headless"""
+    fixed_timestep.save_positions()
+    with profiler.scope('update'):
+        all_gameObjects.update(tick)
+    with profiler.scope('turrets'):
+        turrets.update(character)
+    with profiler.scope('projectiles'):
+        projectiles.update(tick)
+
+    with profiler.scope('camera'):
+        camera.update(character)
+    with profiler.scope('world'):
+        world_generator.update()
+    with profiler.scope('events'):
+        event_controller.apply()
+
+
+def run_frame(steps):
+    """Шаги симуляции одного кадра (их число дает FixedTimestep или запись InputRecorder)"""
+    for _ in range(steps):
+        tick = game_clock.advance(fixed_timestep.step)
+        if game_clock.paused:
+            continue
+
+        simulate(tick)
+
+
+def apply_action(action):
+    """Выполняет действие кадра (кортеж из кода InputRecorder и, для создания объектов, мировых x, y)"""
+    if action[0] == InputRecorder.WEAPON_CHANGE:
+        event_controller.add_event(Event(tags=['Weapon change', 'Character'], weapon=weapons_of_character[
+            (weapons_of_character.index(type(character.weapon)) + 1) % len(weapons_of_character)]))
+    elif action[0] == InputRecorder.PAUSE:
+        game_clock.paused = not game_clock.paused
+    elif action[0] == InputRecorder.ITEM_SPAWNER:
+        ItemSpawner(action[1], action[2])
+    elif action[0] == InputRecorder.AID_KIT:
+        AidKid(action[1], action[2])
+
+
+def world_checksum():
+    """Контрольная сумма состояния мира: игровое время, игрок, клетка, положения всех объектов и пуль"""
+    state = [game_clock.now, character.x, character.y, character.hp, character.coins, len(all_gameObjects),
+             *world_generator.character_cell]
+    checksum = zlib.crc32(struct.pack(f'<{len(state)}d', *state))
+    checksum = zlib.crc32(np.array([(_object.x, _object.y) for _object in all_gameObjects], dtype=float).tobytes(),
+                          checksum)
+    alive = projectiles.alive[:projectiles.count]
+    checksum = zlib.crc32(projectiles.x[:projectiles.count][alive].tobytes(), checksum)
+    return zlib.crc32(projectiles.y[:projectiles.count][alive].tobytes(), checksum)
+
+
+def run_headless(steps):
+    """
+    Гоняет симуляцию без отрисовки и без ограничения скорости, пока не пройдет steps шагов
+     или не погибнет игрок, и возвращает словарь с пропускной способностью
+    Каждый шаг - отдельный кадр, при записи (--record) клавиши снимаются в начале шага
+    """
+    started = perf_counter()
+    done = 0
+    while done < steps and character.alive():
+        if recorder is not None:
+            recorder.frame(1, input_source.capture(), [])
+        run_frame(1)
+        if recorder is not None:
+            recorder.end_frame()
+        profiler.end_frame()
+        done += 1
+    elapsed = perf_counter() - started
+    result = {'steps': done, 'simulated': round(game_clock.now, 3), 'elapsed': round(elapsed, 3),
+              'steps_per_second': round(done / elapsed, 1) if elapsed else 0.0,
+              'speedup': round(game_clock.now / elapsed, 1) if elapsed else 0.0,
+              'objects': len(all_gameObjects), 'projectiles': projectiles.stats()['in_use'], 'hp': character.hp,
+              'rooms': len(world_generator.cells)}
+    if profiler.enabled:
+        result['profile'] = profiler.stats()
+    return result
+
+
+def run_replay():
+    """
+    Воспроизводит запись replay без отрисовки и без ограничения скорости,
+     сверяет контрольные суммы и возвращает словарь с пропускной способностью
+     и номером кадра, на котором мир разошелся с записью (diverged, None - не разошелся)
+    """
+    started = perf_counter()
+    steps, diverged = 0, None
+    while True:
+        frame = replay.read_frame()
+        if frame is None:
+            break
+        frame_steps, mask, actions = frame
+        for action in actions:
+            apply_action(action)
+        input_source.set_mask(mask)
+        run_frame(frame_steps)
+        profiler.end_frame()
+        steps += frame_steps
+        expected = replay.end_frame()
+        if expected is not None and expected != world_checksum():
+            diverged = replay.frames
+            break
+    elapsed = perf_counter() - started
+    result = {'frames': replay.frames, 'steps': steps, 'simulated': round(game_clock.now, 3),
+              'elapsed': round(elapsed, 3), 'speedup': round(game_clock.now / elapsed, 1) if elapsed else 0.0,
+              'checkpoints': replay.checkpoints, 'diverged': diverged}
+    if profiler.enabled:
+        result['profile'] = profiler.stats()
+    return result
+
+
+running = not HEADLESS
 while running:
-    screen.fill([24, 28, 25])
-    for event in pygame.event.get():
+    if not DIRTY_RECTS:
+        screen.fill([24, 28, 25])
+    with profiler.scope('input'):
+        frame_events = pygame.event.get()
+    frame_actions = []
+    for event in frame_events:
         if event.type == pygame.QUIT or event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
             running = False
 
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            profiler.toggle_overlay()
+            # overlay рисуется в правом верхнем углу поверх надписи FPS, поэтому, пока он показан, она спрятана
+            if profiler.overlay:
+                all_inscriptions.pop('FPS: ', None)
+            elif character.alive():
+                all_inscriptions['FPS: '] = character.fps_inscription
+            if DIRTY_RECTS:
+                dirty_renderer.invalidate()
+
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-            ItemSpawner(event.pos[0], event.pos[1])
+            frame_actions.append((InputRecorder.ITEM_SPAWNER, *camera.to_world(event.pos[0], event.pos[1])))
 
         if event.type == pygame.MOUSEBUTTONDOWN and event.button == 3:
-            AidKid(event.pos[0], event.pos[1])
-
-        if event.type == pygame.KEYDOWN and event.key == pygame.K_TAB:
-            event_controller.add_event(Event(tags=['Weapon change', 'Character'], weapon=weapons_of_character[
-                (weapons_of_character.index(type(character.weapon)) + 1) % len(weapons_of_character)]))
-
-    fps = clock.tick() / 1000
+            frame_actions.append((InputRecorder.AID_KIT, *camera.to_world(event.pos[0], event.pos[1])))
 
-    all_gameObjects.update(fps)
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_p:
+            frame_actions.append((InputRecorder.PAUSE,))
 
-    camera.update(character)
-    world_generator.update()
-
-    all_gameObjects.draw(screen)
-    print_inscriptions()
-    event_controller.apply()
-
-    pygame.display.flip()
-
-cur.execute(f"""INSERT INTO passing
-                (id, datetime, kills, item_1, item_2, item_3, hp, max_distance)
-                VALUES
-                (?, ?, ?, ?, ?, ?, ?, ?);""", (_id, _datetime, KILLS, character.items[0].name,
-                                               character.items[1].name, character.items[2].name,
-                                               character.hp, len(world_generator.cells) - 3)).fetchall()
-con.commit()
-con.close()
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_TAB:
+            frame_actions.append((InputRecorder.WEAPON_CHANGE,))
+
+    for action in frame_actions:
+        apply_action(action)
+    frame_steps = fixed_timestep.steps(clock.tick(FPS_CAP) / 1000)
+    if recorder is not None:
+        recorder.frame(frame_steps, input_source.capture(), frame_actions)
+    run_frame(frame_steps)
+    if recorder is not None:
+        recorder.end_frame()
+    camera.alpha = 1 if game_clock.paused else fixed_timestep.alpha
+
+    with profiler.scope('draw'):
+        if DIRTY_RECTS:
+            dirty_rects = dirty_renderer.draw(screen, camera)
+        else:
+            all_gameObjects.draw(screen, camera)
+    if profiler.overlay:
+        overlay_rect = profiler.draw(screen)
+        if DIRTY_RECTS:
+            dirty_rects.append(overlay_rect)
+
+    with profiler.scope('flip'):
+        if DIRTY_RECTS:
+            pygame.display.update(dirty_rects)
+        else:
+            pygame.display.flip()
+    profiler.end_frame()
+
+if SCENARIO is not None:
+    print(json.dumps(Benchmark(SCENARIO).run(STEPS or 1200)))
+elif HEADLESS:
+    result = run_replay() if replay is not None else run_headless(STEPS or int(60 / fixed_timestep.step))
+    profile = result.pop('profile', None)
+    print(' '.join(f'{key}={value}' for key, value in result.items()))
+    if profile is not None:
+        for name, values in profile.items():
+            print(f'{name}: ' + ' '.join(f'{key}={value}' for key, value in values.items()))
+else:
+    with tracer.span('db.write'):
+        cur.execute(f"""INSERT INTO passing
+                        (id, datetime, kills, item_1, item_2, item_3, hp, max_distance)
+                        VALUES
+                        (?, ?, ?, ?, ?, ?, ?, ?);""", (_id, _datetime, KILLS, character.items[0].name,
+                                                       character.items[1].name, character.items[2].name,
+                                                       character.hp, 2 * world_generator.max_distance)).fetchall()
+        con.commit()
+    con.close()
+if world_generator.prefetcher is not None:
+    world_generator.prefetcher.stop()
+if recorder is not None:
+    recorder.close()
+tracer.close()
+if replay is not None and result['diverged'] is not None:
+    sys.exit(1)